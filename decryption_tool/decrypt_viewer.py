@@ -1,52 +1,281 @@
 import json
 import base64
 import hashlib
+import hmac
 import os
+import sys
+import glob
+import time
+import struct
 import getpass
-from cryptography.fernet import Fernet
+import argparse
+import functools
+import concurrent.futures
+from cryptography.fernet import Fernet, InvalidToken
+
+# Chunked stream format written by the app's "Export Backup" (see main.py):
+# a JSON header line with the KDF parameters and salt, then one Fernet token
+# per line, each over (chunk index, last flag, payload).
+BACKUP_FORMAT = "interest-calculator-backup"
+BACKUP_FRAME = struct.Struct(">IB")
+LEGACY_ITERATIONS = 100000
+
+class BackupError(Exception):
+    pass
+
+# Memoized per (password, salt, iterations): files sharing a salt skip the PBKDF2 run
+@functools.lru_cache(maxsize=64)
+def derive_key(password, salt, iterations=LEGACY_ITERATIONS):
+    kdf = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return base64.urlsafe_b64encode(kdf)
+
+def read_header(f):
+    """Header of a chunked backup, or None for the legacy single-token format"""
+    try:
+        header = json.loads(f.readline().decode('utf-8'))
+    except ValueError:
+        return None
+    if isinstance(header, dict) and header.get("format") == BACKUP_FORMAT and header.get("is_encrypted"):
+        return header
+    return None
+
+def header_kdf(header):
+    """(salt, iterations) of a chunked backup header"""
+    return base64.b64decode(header["salt"]), header.get("iterations", LEGACY_ITERATIONS)
+
+def decrypt_stream(f, header, password, out, key=None):
+    """Decrypt the chunks after the header into out, one chunk at a time"""
+    key = key or derive_key(password, *header_kdf(header))
+    check = header.get("key_check")
+    if check and not hmac.compare_digest(check, hmac.new(key, b"backup-key-check", hashlib.sha256).hexdigest()):
+        raise BackupError("Wrong password.")
+    fernet = Fernet(key)
+
+    expected = 0
+    finished = False
+    for line_number, line in enumerate(f, start=2):
+        line = line.strip()
+        if not line:
+            continue
+        if finished:
+            raise BackupError(f"Unexpected data after the last chunk (line {line_number}).")
+        try:
+            frame = fernet.decrypt(line)
+        except InvalidToken:
+            raise BackupError(f"Chunk {expected + 1} (line {line_number}) is corrupt.")
+        index, last = BACKUP_FRAME.unpack_from(frame)
+        if index != expected:
+            raise BackupError(f"Chunk {expected + 1} (line {line_number}) is out of order: found chunk {index + 1}.")
+        out.write(frame[BACKUP_FRAME.size:])
+        expected += 1
+        finished = bool(last)
+    if not finished:
+        raise BackupError(f"Backup is truncated: the last chunk is missing after chunk {expected}.")
+    return expected
+
+def decrypt_legacy(backup_data, password):
+    """Single Fernet token over the whole data set (older app versions)"""
+    salt = base64.b64decode(backup_data["salt"])
+    f = Fernet(derive_key(password, salt))
+    try:
+        decrypted_bytes = f.decrypt(backup_data["data"].encode())
+    except InvalidToken:
+        raise BackupError("Wrong password or corrupt backup.")
+    return json.loads(decrypted_bytes.decode('utf-8'))
+
+def is_encrypted_backup(file_path):
+    with open(file_path, "rb") as f:
+        if read_header(f):
+            return True
+        f.seek(0)
+        try:
+            backup_data = json.load(f)
+        except ValueError:
+            return False
+    return isinstance(backup_data, dict) and bool(backup_data.get("is_encrypted"))
+
+def output_path_for(file_path):
+    base, ext = os.path.splitext(file_path)
+    return f"{base}_decrypted{ext or '.json'}"
+
+def decrypt_file(file_path, password, output_file=None, keys=None):
+    """Decrypt one backup file (chunked or legacy); returns the output path.
+
+    keys optionally maps (salt, iterations) to an already derived key.
+    """
+    output_file = output_file or output_path_for(file_path)
+    with open(file_path, "rb") as f:
+        header = read_header(f)
+        if header:
+            # Written to a temporary name so a failed run leaves no partial output
+            partial = output_file + ".part"
+            try:
+                with open(partial, "wb") as out:
+                    decrypt_stream(f, header, password, out, (keys or {}).get(header_kdf(header)))
+                os.replace(partial, output_file)
+            finally:
+                if os.path.exists(partial):
+                    os.remove(partial)
+            return output_file
+
+        f.seek(0)
+        try:
+            backup_data = json.load(f)
+        except ValueError:
+            raise BackupError("Not a backup file.")
+
+    if not isinstance(backup_data, dict) or not backup_data.get("is_encrypted"):
+        raise BackupError("This file is NOT encrypted. You can open it directly.")
+
+    decrypted_json = decrypt_legacy(backup_data, password)
+    with open(output_file, "w") as f:
+        json.dump(decrypted_json, f, indent=4)
+    return output_file
 
 def decrypt_backup():
     print("=== Backup Decryption Tool ===")
-    
+
     # 1. Ask for file path
     file_path = input("Enter path to backup file (drag & drop file here): ").strip().replace('"', '')
-    
+
     if not os.path.exists(file_path):
         print("Error: File not found!")
         return
 
     try:
-        with open(file_path, "r") as f:
-            backup_data = json.load(f)
-            
-        if not backup_data.get("is_encrypted"):
+        if not is_encrypted_backup(file_path):
             print("This file is NOT encrypted. You can open it directly.")
             return
 
         # 2. Ask for password
         password = getpass.getpass("Enter decryption password: ")
-        
-        # 3. Decrypt
-        salt = base64.b64decode(backup_data["salt"])
-        kdf = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, 100000)
-        key = base64.urlsafe_b64encode(kdf)
-        f = Fernet(key)
-        
-        decrypted_bytes = f.decrypt(backup_data["data"].encode())
-        decrypted_json = json.loads(decrypted_bytes.decode('utf-8'))
-        
-        # 4. Save
-        output_file = file_path.replace(".json", "_decrypted.json")
-        with open(output_file, "w") as f:
-            json.dump(decrypted_json, f, indent=4)
-            
+
+        # 3. Decrypt and save
+        output_file = decrypt_file(file_path, password)
+
         print(f"\n✅ Success! Decrypted data saved to:\n{output_file}")
-        
+
+    except BackupError as e:
+        print(f"\n❌ Decryption Failed: {e}")
     except Exception as e:
         print(f"\n❌ Decryption Failed: {e}")
         print("Make sure the password is correct.")
 
+# --- Batch Mode ---
+def expand_inputs(patterns):
+    """Files matched by the given paths/globs, in order, without duplicates"""
+    files, unmatched = [], []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern, recursive=True)) or ([pattern] if os.path.isfile(pattern) else [])
+        matches = [path for path in matches if os.path.isfile(path)]
+        if not matches:
+            unmatched.append(pattern)
+        files.extend(matches)
+    return list(dict.fromkeys(os.path.abspath(path) for path in files)), unmatched
+
+def read_password(args):
+    if args.password_file:
+        with open(args.password_file, "r") as f:
+            return f.readline().rstrip("\r\n")
+    if args.password_env:
+        password = os.environ.get(args.password_env)
+        if password is None:
+            raise SystemExit(f"Error: environment variable {args.password_env} is not set")
+        return password
+    return getpass.getpass("Enter decryption password: ")
+
+def output_paths(files, output_dir):
+    """<output_dir>/<name>_decrypted.json per file; repeated names get a numeric suffix"""
+    taken = set()
+    paths = []
+    for file_path in files:
+        base, ext = os.path.splitext(os.path.basename(output_path_for(file_path)))
+        candidate, n = base + ext, 2
+        while candidate in taken:
+            candidate, n = f"{base}_{n}{ext}", n + 1
+        taken.add(candidate)
+        paths.append(os.path.join(output_dir, candidate))
+    return paths
+
+def chunked_kdf(file_path):
+    """(salt, iterations) for a chunked backup, None for legacy/unreadable files"""
+    try:
+        with open(file_path, "rb") as f:
+            header = read_header(f)
+        return header_kdf(header) if header else None
+    except (OSError, KeyError, ValueError):
+        return None
+
+def derive_for(password, kdf):
+    return derive_key(password, *kdf)
+
+def decrypt_task(file_path, password, output_file, keys):
+    """Worker entry point: (file, output or None, error or None)"""
+    try:
+        return file_path, decrypt_file(file_path, password, output_file, keys), None
+    except BackupError as e:
+        return file_path, None, str(e)
+    except Exception as e:
+        return file_path, None, f"{type(e).__name__}: {e}"
+
+def run_batch(args):
+    files, unmatched = expand_inputs(args.inputs)
+    for pattern in unmatched:
+        print(f"Warning: no files match {pattern}")
+    if not files:
+        print("Error: no input files.")
+        return 1
+
+    password = read_password(args)
+    os.makedirs(args.output_dir, exist_ok=True)
+    workers = max(1, min(args.workers or os.cpu_count() or 1, len(files)))
+    print(f"Decrypting {len(files)} files with {workers} workers...")
+    start = time.perf_counter()
+    failures = []
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        # Derive each distinct (salt, iterations) once, in parallel, then hand the keys to every file task
+        file_kdfs = list(pool.map(chunked_kdf, files))
+        kdfs = list(dict.fromkeys(kdf for kdf in file_kdfs if kdf))
+        keys = dict(zip(kdfs, pool.map(functools.partial(derive_for, password), kdfs)))
+
+        futures = [pool.submit(decrypt_task, file_path, password, output_file, {kdf: keys[kdf]} if kdf else None)
+                   for file_path, output_file, kdf in zip(files, output_paths(files, args.output_dir), file_kdfs)]
+        for future in concurrent.futures.as_completed(futures):
+            file_path, output_file, error = future.result()
+            if error:
+                failures.append((file_path, error))
+                print(f"❌ {file_path}: {error}")
+            elif args.verbose:
+                print(f"✅ {file_path} -> {output_file}")
+
+    elapsed = time.perf_counter() - start
+    print(f"\nDone in {elapsed:.1f}s: {len(files) - len(failures)} succeeded, {len(failures)} failed "
+          f"({len(kdfs)} keys derived for {len(files)} files)")
+    for file_path, error in sorted(failures):
+        print(f"  {file_path}: {error}")
+    return 1 if failures else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Decrypt Interest Calculator backups. Without arguments, asks for one file interactively.")
+    parser.add_argument("inputs", nargs="*", help="Backup files or glob patterns (quote them, e.g. 'audit/**/*.json')")
+    parser.add_argument("-o", "--output-dir", default="decrypted", help="Directory for decrypted files (default: decrypted)")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--password-env", metavar="VAR", help="Read the password from this environment variable")
+    source.add_argument("--password-file", metavar="PATH", help="Read the password from the first line of this file")
+    parser.add_argument("-j", "--workers", type=int, default=0, help="Parallel worker processes (default: CPU count)")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Also list every decrypted file")
+    return parser.parse_args(argv)
+
 if __name__ == "__main__":
+    args = parse_args()
+    if args.inputs:
+        try:
+            sys.exit(run_batch(args))
+        except KeyboardInterrupt:
+            print("\nCancelled.")
+            sys.exit(130)
+
     try:
         decrypt_backup()
     except KeyboardInterrupt:
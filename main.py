@@ -1,15 +1,31 @@
 
 import flet as ft
-from datetime import datetime
+from datetime import datetime, timezone
 import json
 import os
 import smtplib
 import random
 import hashlib
+import hmac
 import secrets
+import shutil
 import re
 import time
 import threading
+import functools
+import bisect
+import ssl
+import socket
+import http.client
+import concurrent.futures
+import heapq
+import struct
+import itertools
+import queue
+import urllib.parse
+from collections import deque, OrderedDict
+from collections.abc import MutableMapping
+from contextlib import contextmanager
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 
@@ -24,23 +40,2165 @@ except ImportError:
     CRYPTO_AVAILABLE = False
     print("Warning: cryptography module not available. Using base64 fallback for encryption.")
 
-def hash_password(password):
+# --- Password Hashing ---
+# Stored as "pbkdf2_sha256$<iterations>$<salt hex>$<hash hex>" so the cost can change
+# per device class and older hashes can be recognised and upgraded on login.
+PASSWORD_SCHEME = "pbkdf2_sha256"
+DEFAULT_PASSWORD_ITERATIONS = 100000
+LEGACY_PASSWORD_ITERATIONS = 100000
+
+def hash_password(password, iterations=DEFAULT_PASSWORD_ITERATIONS):
     """Hash a password for storing."""
     salt = os.urandom(16)
-    pwdhash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, 100000)
-    return salt.hex() + '$' + pwdhash.hex()
+    pwdhash = hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, iterations)
+    return f"{PASSWORD_SCHEME}${iterations}${salt.hex()}${pwdhash.hex()}"
 
 def verify_password(stored_password, provided_password):
-    """Verify a stored password against one provided by user"""
+    """Verify a stored password against one provided by user.
+
+    Also accepts the two older "salt$hash" encodings and plain-text passwords.
+    """
+    password = provided_password.encode('utf-8')
+    parts = stored_password.split('$')
+    try:
+        if len(parts) == 4 and parts[0] == PASSWORD_SCHEME:
+            pwdhash = hashlib.pbkdf2_hmac('sha256', password, bytes.fromhex(parts[2]), int(parts[1]))
+            return hmac.compare_digest(pwdhash.hex(), parts[3])
+        if len(parts) == 2:
+            salt, hash_hex = parts
+            # The app used the salt's hex text as the salt; earlier code used its bytes
+            for salt_bytes in [salt.encode(), bytes.fromhex(salt)]:
+                pwdhash = hashlib.pbkdf2_hmac('sha256', password, salt_bytes, LEGACY_PASSWORD_ITERATIONS)
+                if hmac.compare_digest(pwdhash.hex(), hash_hex):
+                    return True
+            return False
+    except ValueError:
+        pass
+    # Fallback for old plain-text passwords (migration)
+    return hmac.compare_digest(stored_password.encode('utf-8'), password)
+
+def password_needs_upgrade(stored_password, iterations=DEFAULT_PASSWORD_ITERATIONS):
+    """True for legacy/plain-text hashes or ones weaker than `iterations`"""
+    parts = stored_password.split('$')
+    if len(parts) != 4 or parts[0] != PASSWORD_SCHEME:
+        return True
+    try:
+        return int(parts[1]) < iterations
+    except ValueError:
+        return True
+
+# --- Session Tokens ---
+# "<base64url payload>.<hex HMAC-SHA256>", signed with a per-device secret plus the
+# user's password hash, so changing the password invalidates outstanding tokens.
+def _session_key(secret, password_hash):
+    return hashlib.sha256(f"{secret}:{password_hash}".encode('utf-8')).digest()
+
+def issue_session_token(secret, user_id, password_hash, lifetime):
+    """Create a signed token letting user_id resume for `lifetime` seconds"""
+    now = int(time.time())
+    payload = json.dumps({"user": user_id, "iat": now, "exp": now + lifetime, "jti": secrets.token_hex(8)})
+    body = base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+    signature = hmac.new(_session_key(secret, password_hash), body.encode('ascii'), hashlib.sha256).hexdigest()
+    return f"{body}.{signature}"
+
+def read_session_token(token):
+    """Unverified payload of a token (to find whose password hash to check it with)"""
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.split('.')[0].encode('ascii')))
+    except (ValueError, AttributeError):
+        return None
+
+def verify_session_token(secret, token, password_hash):
+    """Payload of a valid, unexpired token, else None"""
     try:
-        salt_hex, hash_hex = stored_password.split('$')
-        salt = bytes.fromhex(salt_hex)
-        pwdhash = hashlib.pbkdf2_hmac('sha256', provided_password.encode('utf-8'), salt, 100000)
-        return pwdhash.hex() == hash_hex
-    except Exception:
+        body, signature = token.split('.')
+    except (ValueError, AttributeError):
+        return None
+    expected = hmac.new(_session_key(secret, password_hash), body.encode('ascii'), hashlib.sha256).hexdigest()
+    if not hmac.compare_digest(expected, signature):
+        return None
+    payload = read_session_token(token)
+    if not payload or payload.get("exp", 0) < time.time():
+        return None
+    return payload
+
+# --- Deadline Scheduler (Session Timeouts) ---
+class DeadlineScheduler:
+    """One thread running callbacks at per-key deadlines (a heap of pending wake-ups).
+
+    Re-arming a key with a later deadline is O(1): its heap entry stays put and is
+    pushed back to the new deadline when it comes due. Callbacks run on their own
+    short-lived thread so one slow page cannot delay the others.
+    """
+    def __init__(self):
+        self.entries = {}  # {key: {"deadline", "callback", "queued": heap time}}
+        self.heap = []  # (time, seq, key)
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.thread = threading.Thread(target=self._run, name="deadline-scheduler", daemon=True)
+        self.thread.start()
+
+    def schedule(self, key, deadline, callback):
+        """Run callback() at `deadline` (time.time()), replacing key's previous deadline"""
+        with self.cond:
+            entry = self.entries.get(key)
+            if entry is None:
+                entry = self.entries[key] = {"queued": None}
+            entry["deadline"] = deadline
+            entry["callback"] = callback
+            if entry["queued"] is None or deadline < entry["queued"]:
+                entry["queued"] = deadline
+                heapq.heappush(self.heap, (deadline, next(self.seq), key))
+                self.cond.notify()
+
+    def cancel(self, key):
+        with self.cond:
+            self.entries.pop(key, None)
+
+    def __len__(self):
+        with self.cond:
+            return len(self.entries)
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    now = time.time()
+                    if self.heap and self.heap[0][0] <= now:
+                        queued, _, key = heapq.heappop(self.heap)
+                        entry = self.entries.get(key)
+                        if entry is None or entry["queued"] != queued:
+                            continue  # cancelled or superseded by an earlier wake-up
+                        if entry["deadline"] > now:
+                            # Re-armed since this was queued: wake up again later
+                            entry["queued"] = entry["deadline"]
+                            heapq.heappush(self.heap, (entry["deadline"], next(self.seq), key))
+                            continue
+                        del self.entries[key]
+                        callback = entry["callback"]
+                        break
+                    self.cond.wait(self.heap[0][0] - now if self.heap else None)
+            threading.Thread(target=callback, daemon=True).start()
+
+_session_scheduler = None
+_session_scheduler_lock = threading.Lock()
+
+def session_scheduler():
+    """The process-wide scheduler shared by every page's session timeout"""
+    global _session_scheduler
+    with _session_scheduler_lock:
+        if _session_scheduler is None:
+            _session_scheduler = DeadlineScheduler()
+        return _session_scheduler
+
+# --- One-Time Codes ---
+class OtpStore:
+    """One-time codes that really expire, with a wrong-guess limit and a size cap.
+
+    A min-heap of (expires_at, key) makes expiry O(log n) per code; heap entries
+    for codes that were replaced meanwhile are skipped when they surface.
+    """
+    def __init__(self, ttl=600, max_attempts=5, max_entries=1000):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.max_entries = max_entries
+        self.entries = {}  # {key: {"otp", "expires", "attempts", ...}}
+        self.heap = []
+        self.lock = threading.Lock()
+
+    def _expire(self, now):
+        while self.heap and self.heap[0][0] <= now:
+            self._pop_oldest()
+
+    def _pop_oldest(self):
+        expires, key = heapq.heappop(self.heap)
+        entry = self.entries.get(key)
+        if entry and entry["expires"] == expires:
+            del self.entries[key]
+
+    def put(self, key, otp, **extra):
+        """Store a fresh code for key, replacing any previous one"""
+        now = time.time()
+        with self.lock:
+            self._expire(now)
+            # Full: drop the codes closest to expiry
+            while key not in self.entries and len(self.entries) >= self.max_entries:
+                self._pop_oldest()
+            expires = now + self.ttl
+            self.entries[key] = dict(extra, otp=otp, expires=expires, attempts=0)
+            heapq.heappush(self.heap, (expires, key))
+            # Replaced codes leave stale heap entries behind; compact if they pile up
+            if len(self.heap) > 2 * len(self.entries) + 64:
+                self.heap = [(entry["expires"], k) for k, entry in self.entries.items()]
+                heapq.heapify(self.heap)
+
+    def verify(self, key, code):
+        """Check and consume a code; returns (valid, message for the user)"""
+        with self.lock:
+            self._expire(time.time())
+            entry = self.entries.get(key)
+            if not entry:
+                return False, "Code expired or not found. Please request a new one."
+            # As bytes: compare_digest rejects str with non-ASCII characters (e.g. full-width digits)
+            if hmac.compare_digest(entry["otp"].encode(), (code or "").encode()):
+                del self.entries[key]
+                return True, ""
+            entry["attempts"] += 1
+            left = self.max_attempts - entry["attempts"]
+            if left <= 0:
+                del self.entries[key]
+                return False, "Too many wrong codes. Please request a new one."
+            return False, f"Invalid code ({left} attempts left)"
+
+    def discard(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+    def __len__(self):
+        with self.lock:
+            self._expire(time.time())
+            return len(self.entries)
+
+# --- Email Delivery ---
+class SmtpMailer:
+    """Background email sender that keeps one authenticated SMTP connection open.
+
+    Messages are queued and sent in order by a single worker thread; the connection
+    is reused across messages, re-opened when the server drops it, and closed after
+    idle_timeout seconds without mail. Each send reports (ok, message) to its callback.
+    """
+    def __init__(self, host, port, username=None, password=None, use_tls=True, idle_timeout=60, timeout=15):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.conn = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="smtp-mailer", daemon=True)
+        self.thread.start()
+
+    def send(self, msg, callback=None):
+        """Queue an email.message.Message for delivery"""
+        self.queue.put((msg, callback))
+
+    def close(self):
+        self.queue.put(None)
+
+    def _connect(self):
+        conn = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+        if self.use_tls:
+            conn.starttls(context=ssl.create_default_context())
+        if self.username:
+            conn.login(self.username, self.password)
+        return conn
+
+    def _disconnect(self):
+        if self.conn:
+            try:
+                self.conn.quit()
+            except (smtplib.SMTPException, OSError):
+                self.conn.close()
+            self.conn = None
+
+    def _deliver(self, msg):
+        # A reused connection may have been dropped by the server -> reconnect once
+        for attempt in range(2):
+            reused = self.conn is not None
+            if not reused:
+                self.conn = self._connect()
+            try:
+                self.conn.send_message(msg)
+                return
+            except smtplib.SMTPServerDisconnected:
+                self._disconnect()
+                if not reused or attempt:
+                    raise
+            except smtplib.SMTPException:
+                # Rejected by the server (SMTPException subclasses OSError, so check it first):
+                # leave the connection in a clean state for the next message
+                try:
+                    self.conn.rset()
+                except OSError:
+                    self._disconnect()
+                raise
+            except OSError:
+                self._disconnect()
+                if not reused or attempt:
+                    raise
+
+    def _run(self):
+        while True:
+            try:
+                job = self.queue.get(timeout=self.idle_timeout)
+            except queue.Empty:
+                self._disconnect()  # idle: don't hold the server's connection slot
+                continue
+            if job is None:
+                self._disconnect()
+                return
+            msg, callback = job
+            try:
+                self._deliver(msg)
+                result = (True, f"Email sent to {msg['To']}")
+            except Exception as e:
+                print(f"Email error: {e}")
+                result = (False, f"Email to {msg['To']} failed: {e}")
+            if callback:
+                try:
+                    callback(*result)
+                except Exception as e:
+                    print(f"Email callback error: {e}")
+
+_mailers = {}
+_mailers_lock = threading.Lock()
+
+def shared_mailer(settings):
+    """One mailer (and SMTP connection) per server/account for the whole process"""
+    key = (settings["smtp_server"], int(settings["smtp_port"]), settings.get("sender_email"))
+    with _mailers_lock:
+        if key not in _mailers:
+            _mailers[key] = SmtpMailer(
+                settings["smtp_server"], int(settings["smtp_port"]),
+                username=settings.get("sender_email") if settings.get("use_auth", True) else None,
+                password=settings.get("sender_password"),
+                use_tls=settings.get("use_tls", True),
+            )
+        return _mailers[key]
+
+# --- SMS Delivery ---
+class TwilioSmsProvider:
+    """Sends through Twilio with one client reused for every message"""
+    name = "twilio"
+
+    def __init__(self, account_sid, auth_token, from_number):
+        from twilio.rest import Client  # ImportError -> caller falls back (e.g. Android build)
+        self.client = Client(account_sid, auth_token)
+        self.from_number = from_number
+
+    def send(self, to, body):
+        self.client.messages.create(body=body, from_=self.from_number, to=to)
+
+    def is_retryable(self, error):
+        status = getattr(error, "status", None)
+        return status is None or is_retryable_status(status)
+
+class ConsoleSmsProvider:
+    """Prints messages instead of sending them (demo mode / no Twilio available)"""
+    name = "console"
+
+    def send(self, to, body):
+        print(f"[SMS to {to}] {body}")
+
+    def is_retryable(self, error):
         return False
 
+class RecordingSmsProvider:
+    """Local stand-in that keeps sent messages in memory, for tests and load runs"""
+    name = "stub"
+
+    def __init__(self, latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.sent = []  # [(to, body, sent_at)]
+        self.lock = threading.Lock()
+
+    def send(self, to, body):
+        if self.latency:
+            time.sleep(self.latency)
+        if self.error_rate and random.random() < self.error_rate:
+            raise ConnectionError("simulated SMS failure")
+        with self.lock:
+            self.sent.append((to, body, time.time()))
+
+    def messages(self, to=None):
+        """Copy of the recorded (to, body, sent_at) messages, optionally for one number"""
+        with self.lock:
+            return [message for message in self.sent if to is None or message[0] == to]
+
+    def is_retryable(self, error):
+        return True
+
+class SmsDispatcher:
+    """Queued SMS sending: token-bucket rate limit, a few sender threads, retry with backoff.
+
+    One scheduler thread releases due messages as tokens allow; a small pool does
+    the provider calls, so a slow provider call does not hold up other numbers.
+    A failed send is re-queued with a not-before time instead of sleeping in a
+    worker, and a message still unsent at its expires_at is dropped (an OTP past
+    its TTL is useless). Each message reports (ok, message) to its callback, and
+    its latency/failures to the SyncStats it was queued with ("SMS send").
+    """
+    MIN_RATE = 0.01  # messages per second; 0 or less would stall the scheduler
+
+    def __init__(self, provider, rate_per_second=1.0, burst=5, max_retries=3, base_delay=1.0, workers=4):
+        if rate_per_second < self.MIN_RATE or burst < 1 or workers < 1:
+            print(f"SMS: invalid rate limit settings (rate_per_second={rate_per_second}, burst={burst}, "
+                  f"workers={workers}); using rate_per_second>={self.MIN_RATE}, burst>=1, workers>=1")
+        self.provider = provider
+        self.rate = max(rate_per_second, self.MIN_RATE)
+        self.burst = max(burst, 1)
+        self.tokens = float(self.burst)
+        self.refilled_at = time.monotonic()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.cond = threading.Condition()
+        self.heap = []  # [(not_before, seq, job)], monotonic times
+        self.seq = itertools.count()
+        self.closed = False
+        self.senders = concurrent.futures.ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="sms-send")
+        self.thread = threading.Thread(target=self._run, name="sms-dispatcher", daemon=True)
+        self.thread.start()
+
+    def send(self, to, body, callback=None, stats=None, expires_at=None):
+        """Queue a message; expires_at (time.time()) drops it if it cannot go out in time"""
+        self._schedule(time.monotonic(), {"to": to, "body": body, "callback": callback, "stats": stats,
+                                          "expires_at": expires_at, "attempt": 0})
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def _schedule(self, not_before, job):
+        with self.cond:
+            heapq.heappush(self.heap, (not_before, next(self.seq), job))
+            self.cond.notify()
+
+    def _next_job(self):
+        """Wait for a due message and a rate-limit token; None once closed"""
+        with self.cond:
+            while not self.closed:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.refilled_at) * self.rate)
+                self.refilled_at = now
+                if not self.heap:
+                    self.cond.wait()
+                elif self.heap[0][0] > now:
+                    self.cond.wait(self.heap[0][0] - now)
+                elif self.tokens < 1:
+                    self.cond.wait((1 - self.tokens) / self.rate)
+                else:
+                    job = heapq.heappop(self.heap)[2]
+                    if job["expires_at"] and time.time() > job["expires_at"]:
+                        self._finish(job, (False, f"SMS to {job['to']} not sent in time"))
+                        continue
+                    self.tokens -= 1
+                    return job
+            return None
+
+    def _deliver(self, job):
+        to, body, stats = job["to"], job["body"], job["stats"]
+        start = time.perf_counter()
+        try:
+            self.provider.send(to, body)
+            if stats:
+                stats.record("SMS send", (time.perf_counter() - start) * 1000, len(body))
+            self._finish(job, (True, f"SMS sent to {to}"))
+        except Exception as e:
+            if stats:
+                stats.record("SMS send", (time.perf_counter() - start) * 1000, len(body), error=error_class(e))
+            if job["attempt"] >= self.max_retries or not self.provider.is_retryable(e):
+                print(f"SMS error: {e}")
+                self._finish(job, (False, f"SMS to {to} failed: {e}"))
+                return
+            delay = random.uniform(0, self.base_delay * 2 ** job["attempt"])
+            job["attempt"] += 1
+            print(f"SMS: Retry {job['attempt']}/{self.max_retries} in {delay:.1f}s")
+            self._schedule(time.monotonic() + delay, job)
+
+    def _finish(self, job, result):
+        if job["callback"]:
+            try:
+                job["callback"](*result)
+            except Exception as e:
+                print(f"SMS callback error: {e}")
+
+    def _run(self):
+        while True:
+            job = self._next_job()
+            if job is None:
+                self.senders.shutdown(wait=False)
+                return
+            self.senders.submit(self._deliver, job)
+
+def make_sms_provider(settings):
+    """Provider from config "sms": provider = twilio (default), stub or console"""
+    kind = settings.get("provider", "twilio")
+    if kind == "stub":
+        return RecordingSmsProvider(
+            latency=float(settings.get("stub_latency_ms", 0)) / 1000,
+            error_rate=float(settings.get("stub_error_rate", 0)),
+        )
+    if kind == "twilio":
+        try:
+            return TwilioSmsProvider(settings["twilio_account_sid"], settings["twilio_auth_token"], settings["twilio_phone"])
+        except ImportError:
+            print("[ANDROID] Twilio not available. SMS codes will be printed to the console.")
+    return ConsoleSmsProvider()
+
+_sms_dispatcher = None
+_sms_dispatcher_lock = threading.Lock()
+
+def shared_sms_dispatcher(settings):
+    """Process-wide dispatcher, so the provider client and rate limit are shared"""
+    global _sms_dispatcher
+    with _sms_dispatcher_lock:
+        if _sms_dispatcher is None:
+            _sms_dispatcher = SmsDispatcher(
+                make_sms_provider(settings),
+                rate_per_second=float(settings.get("rate_per_second", 1.0)),
+                burst=int(settings.get("burst", 5)),
+                workers=int(settings.get("workers", 4)),
+            )
+        return _sms_dispatcher
+
+# --- Login Rate Limiting ---
+class SlidingWindowLimiter:
+    """Allow at most `limit` recorded attempts per key within `window` seconds.
+
+    Each key keeps a deque of attempt times. Keys live in LRU order, so stale
+    keys (TTL) are dropped from the front and memory stays under max_keys.
+    """
+    def __init__(self, limit, window, max_keys=10000):
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self.attempts = OrderedDict()  # {key: deque of timestamps}, least recently used first
+        self.rejected = 0
+
+    def _prune(self, key, now):
+        times = self.attempts.get(key)
+        if times is None:
+            return None
+        while times and times[0] <= now - self.window:
+            times.popleft()
+        if not times:
+            del self.attempts[key]
+            return None
+        return times
+
+    def retry_after(self, key, now):
+        """Seconds until key may try again (0 if allowed now)"""
+        times = self._prune(key, now)
+        if times is None or len(times) < self.limit:
+            return 0
+        return times[0] + self.window - now
+
+    def record(self, key, now):
+        times = self.attempts.get(key)
+        if times is None:
+            times = self.attempts[key] = deque(maxlen=self.limit)
+        times.append(now)
+        self.attempts.move_to_end(key)
+        self._evict(now)
+
+    def clear(self, key):
+        self.attempts.pop(key, None)
+
+    def _evict(self, now):
+        # Front keys have the oldest latest attempt: drop expired ones, then enforce the cap
+        while self.attempts:
+            key, times = next(iter(self.attempts.items()))
+            if times[-1] > now - self.window and len(self.attempts) <= self.max_keys:
+                break
+            del self.attempts[key]
+
+class LoginRateLimiter:
+    """Failed-login limits per username and per client (IP or session), shared by all pages"""
+    def __init__(self, per_user=5, per_client=20, window=900, max_keys=10000):
+        self.users = SlidingWindowLimiter(per_user, window, max_keys)
+        self.clients = SlidingWindowLimiter(per_client, window, max_keys)
+        self.lock = threading.Lock()
+
+    def check(self, username, client):
+        """Return (allowed, message); client None skips the per-client limit"""
+        now = time.time()
+        with self.lock:
+            for limiter, key in [(self.users, username), (self.clients, client)]:
+                if key is None:
+                    continue
+                wait = limiter.retry_after(key, now)
+                if wait:
+                    limiter.rejected += 1
+                    minutes = max(1, int(wait // 60) + 1)
+                    return False, f"Too many login attempts. Please try again in {minutes} minutes."
+        return True, ""
+
+    def record_failure(self, username, client):
+        now = time.time()
+        with self.lock:
+            self.users.record(username, now)
+            if client is not None:
+                self.clients.record(client, now)
+
+    def clear(self, username):
+        """Successful login: forget the username's failures (the client's stay)"""
+        with self.lock:
+            self.users.clear(username)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "tracked_users": len(self.users.attempts),
+                "tracked_clients": len(self.clients.attempts),
+                "rejected_by_user": self.users.rejected,
+                "rejected_by_client": self.clients.rejected,
+            }
+
+_login_limiter = None
+_login_limiter_lock = threading.Lock()
+
+def shared_login_limiter(settings):
+    """Process-wide limiter (one web server hosts many pages), built from config "rate_limit" """
+    global _login_limiter
+    with _login_limiter_lock:
+        if _login_limiter is None:
+            _login_limiter = LoginRateLimiter(
+                per_user=int(settings.get("max_attempts_per_user", 5)),
+                per_client=int(settings.get("max_attempts_per_client", 20)),
+                window=float(settings.get("window_minutes", 15)) * 60,
+                max_keys=int(settings.get("max_tracked_keys", 10000)),
+            )
+        return _login_limiter
+
+# --- Diagnostics (Span Timing) ---
+class SpanTimer:
+    """Keeps the most recent named timing spans in a ring buffer"""
+    def __init__(self, capacity=200):
+        self.origin = time.perf_counter()
+        self.origin_wall = time.time()
+        self.spans = deque(maxlen=capacity)
+        self.lock = threading.Lock()
+
+    def record(self, name, start, end):
+        """Record a finished span (perf_counter start/end values)"""
+        with self.lock:
+            self.spans.append({
+                "name": name,
+                "start_ms": round((start - self.origin) * 1000, 2),
+                "duration_ms": round((end - start) * 1000, 2),
+                "thread": threading.current_thread().name,
+            })
+
+    def mark(self, name):
+        """Record a zero-length span, e.g. an entry point"""
+        now = time.perf_counter()
+        self.record(name, now, now)
+
+    @contextmanager
+    def span(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start, time.perf_counter())
+
+    def timed(self, name):
+        """Decorator version of span()"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.spans)
+
+    def summary_lines(self, limit=15):
+        """Latest spans formatted for display (newest first)"""
+        return [f"{s['name']}: {s['duration_ms']:.1f} ms" for s in reversed(self.snapshot()[-limit:])]
+
+    def to_json(self):
+        """Dump all buffered spans as JSON for offline analysis"""
+        return json.dumps({
+            "started_at": datetime.fromtimestamp(self.origin_wall).isoformat(),
+            "spans": self.snapshot(),
+        }, indent=2)
+
+# --- UI Update Batching ---
+class UpdateBatcher:
+    """Coalesces the updates a user action makes into one message to the client.
+
+    Inside batch() (nestable, tracked per thread) update() only records what is
+    dirty; the outermost scope sends it all at once when it exits. Outside any
+    scope update() is sent straight away, like page.update().
+
+    page.update and page.open are routed through the batcher, so the existing
+    page.update() / control.update() / page.open() / page.close() calls made
+    inside a scope are batched too.
+    """
+    def __init__(self, page):
+        self.page = page
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.actions = {}  # {action: [runs, updates requested, messages sent]}
+        self.send_update = page.update
+        self.page_open = page.open
+        page.update = self.update
+        page.open = self.open
+
+    @contextmanager
+    def batch(self, action=None):
+        state = self.local
+        if not getattr(state, "depth", 0):
+            state.action = action
+            state.controls = {}  # id -> control, in first-dirtied order
+            state.whole_page = False
+            state.requested = 0
+            state.depth = 0
+        state.depth += 1
+        try:
+            yield
+        finally:
+            state.depth -= 1
+            if state.depth == 0:
+                sent = self._send(state.whole_page, list(state.controls.values()))
+                if state.action:
+                    with self.lock:
+                        counts = self.actions.setdefault(state.action, [0, 0, 0])
+                        counts[0] += 1
+                        counts[1] += state.requested
+                        counts[2] += sent
+
+    def batched(self, action):
+        """Decorator version of batch()"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.batch(action):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def update(self, *controls):
+        """Update the given controls, or the whole page if none are given"""
+        state = self.local
+        if not getattr(state, "depth", 0):
+            self._send(not controls, controls)
+            return
+        state.requested += 1
+        if not controls:
+            state.whole_page = True
+        for control in controls:
+            state.controls.setdefault(id(control), control)
+
+    def open(self, control):
+        """page.open(); its overlay and control updates join the current scope.
+
+        A control opened for the first time is sent straight away instead: Flet
+        updates it right after the overlay update that mounts it, which can't wait.
+        """
+        state = self.local
+        depth = getattr(state, "depth", 0)
+        if control.page is None:
+            state.depth = 0
+        try:
+            self.page_open(control)
+        finally:
+            state.depth = depth
+
+    def _send(self, whole_page, controls):
+        """Send one update; returns the number of messages sent (0 or 1)"""
+        if whole_page:
+            # A page update diffs the whole tree, dirty controls included
+            self.send_update()
+        elif controls:
+            self.send_update(*controls)
+        else:
+            return 0
+        return 1
+
+    def summary_lines(self):
+        with self.lock:
+            actions = sorted(self.actions.items())
+        return [f"UI {action}: {requested / runs:.1f} updates -> {sent / runs:.1f} messages per run ({runs} runs)"
+                for action, (runs, requested, sent) in actions]
+
+# --- Diagnostics (Sync Telemetry) ---
+class SyncStats:
+    """Per-operation sync request counters and latency histograms.
+
+    Kept per day and persisted to client storage as a rolling summary of the
+    last `days` days, so slow networks and server regressions show up over time.
+    """
+    # Latency histogram bucket upper bounds (ms); the last bucket is open-ended
+    BUCKETS_MS = [10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000]
+    SAVE_INTERVAL = 30  # seconds between persisted snapshots
+
+    def __init__(self, storage=None, key="sync_stats", days=7):
+        self.storage = storage
+        self.key = key
+        self.days = days
+        self.lock = threading.Lock()
+        self.last_save = 0
+        self.data = {}  # {"YYYY-MM-DD": day summary}
+        if storage is not None:
+            try:
+                stored = storage.get(key)
+                if stored:
+                    self.data = json.loads(stored).get("days", {})
+            except Exception as e:
+                print(f"Error loading sync stats: {e}")
+
+    def _today(self):
+        day = datetime.now().strftime('%Y-%m-%d')
+        if day not in self.data:
+            self.data[day] = {"ops": {}, "errors": {}, "retries": 0, "gave_up": 0}
+            # Rolling window: drop the oldest days
+            for old in sorted(self.data)[:-self.days]:
+                del self.data[old]
+        return self.data[day]
+
+    def record(self, operation, duration_ms, sent=0, received=0, error=None):
+        """Record one request; error is a short class like "HTTP 503" or "timeout" """
+        with self.lock:
+            today = self._today()
+            op = today["ops"].setdefault(operation, {
+                "count": 0, "errors": 0, "bytes_sent": 0, "bytes_received": 0,
+                "total_ms": 0.0, "max_ms": 0.0, "buckets": [0] * (len(self.BUCKETS_MS) + 1),
+            })
+            op["count"] += 1
+            op["bytes_sent"] += sent
+            op["bytes_received"] += received
+            op["total_ms"] = round(op["total_ms"] + duration_ms, 2)
+            op["max_ms"] = max(op["max_ms"], round(duration_ms, 2))
+            op["buckets"][bisect.bisect_left(self.BUCKETS_MS, duration_ms)] += 1
+            if error:
+                op["errors"] += 1
+                today["errors"][error] = today["errors"].get(error, 0) + 1
+        self._maybe_save()
+
+    def count_retry(self, gave_up=False):
+        with self.lock:
+            self._today()["gave_up" if gave_up else "retries"] += 1
+        self._maybe_save()
+
+    def _maybe_save(self):
+        if time.time() - self.last_save >= self.SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        if self.storage is None:
+            return
+        self.last_save = time.time()
+        try:
+            self.storage.set(self.key, self.to_json(indent=None))
+        except Exception as e:
+            print(f"Error saving sync stats: {e}")
+
+    def totals(self):
+        """All retained days merged into one summary"""
+        merged = {"ops": {}, "errors": {}, "retries": 0, "gave_up": 0}
+        with self.lock:
+            for day in self.data.values():
+                merged["retries"] += day["retries"]
+                merged["gave_up"] += day["gave_up"]
+                for error, count in day["errors"].items():
+                    merged["errors"][error] = merged["errors"].get(error, 0) + count
+                for name, op in day["ops"].items():
+                    total = merged["ops"].setdefault(name, {
+                        "count": 0, "errors": 0, "bytes_sent": 0, "bytes_received": 0,
+                        "total_ms": 0.0, "max_ms": 0.0, "buckets": [0] * (len(self.BUCKETS_MS) + 1),
+                    })
+                    for field in ["count", "errors", "bytes_sent", "bytes_received", "total_ms"]:
+                        total[field] += op[field]
+                    total["max_ms"] = max(total["max_ms"], op["max_ms"])
+                    total["buckets"] = [a + b for a, b in zip(total["buckets"], op["buckets"])]
+        return merged
+
+    def percentile(self, buckets, fraction):
+        """Histogram percentile, reported as the upper bound of the bucket it falls in"""
+        target = sum(buckets) * fraction
+        seen = 0
+        for bound, count in zip(self.BUCKETS_MS + [None], buckets):
+            seen += count
+            if count and seen >= target:
+                return bound
+        return None
+
+    def summary_lines(self):
+        """Short per-operation lines for the Settings dialog"""
+        totals = self.totals()
+        lines = []
+        for name, op in sorted(totals["ops"].items()):
+            p50 = self.percentile(op["buckets"], 0.5)
+            p99 = self.percentile(op["buckets"], 0.99)
+            fmt = lambda bound: f"≤{bound} ms" if bound else f">{self.BUCKETS_MS[-1]} ms"
+            lines.append(f"{name}: {op['count']} ({op['errors']} failed)  p50 {fmt(p50)}  p99 {fmt(p99)}  "
+                         f"↑{op['bytes_sent'] // 1024} KB ↓{op['bytes_received'] // 1024} KB")
+        if totals["retries"] or totals["gave_up"]:
+            lines.append(f"Retries: {totals['retries']}  •  Gave up: {totals['gave_up']}")
+        if totals["errors"]:
+            lines.append("Errors: " + ", ".join(f"{error} ×{count}" for error, count in sorted(totals["errors"].items())))
+        return lines
+
+    def to_json(self, indent=2):
+        with self.lock:
+            return json.dumps({"buckets_ms": self.BUCKETS_MS, "days": self.data}, indent=indent)
+
+def error_class(error):
+    """Coarse failure category for telemetry"""
+    if isinstance(error, (socket.timeout, TimeoutError)):
+        return "timeout"
+    if isinstance(error, ssl.SSLError):
+        return "tls"
+    if isinstance(error, ConnectionError):
+        return "connection"
+    if isinstance(error, OSError):
+        return "network"
+    return type(error).__name__
+
+# --- Shared Account Store (multi-session server mode) ---
+class SharedAccountStore:
+    """Process-wide profiles ("users") and item lists ("data") shared by pages.
+
+    When served as a web app each connection runs main(page). Accounts are keyed
+    by (scope, user_id), where scope identifies the client storage they were
+    loaded from, so only pages backed by the same storage (tabs of one browser)
+    share an account; another client holding the same login ID never sees or
+    overwrites it. Each scope has one id set shared by every page attached to
+    it; the scope's accounts are dropped when its last page detaches. Values
+    are copy-on-write: writers hold the account's lock and replace the profile
+    dict / ItemVector instead of mutating it, so a reader holding the old value
+    always sees a consistent version.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {"users": {}, "data": {}}  # {(scope, user_id): value}
+        self.scopes = {}  # {scope: {"ids": set, "removed": {table: set}, "pages": n}}
+        self.user_locks = {}  # {(scope, user_id): RLock}
+
+    def attach(self, scope, stored_users, stored_data):
+        """Register a page on scope; stored accounts not resident yet are loaded"""
+        with self.lock:
+            entry = self.scopes.get(scope)
+            if entry is None:
+                entry = self.scopes[scope] = {"ids": set(), "removed": {"users": set(), "data": set()}, "pages": 0}
+            entry["pages"] += 1
+            for table, stored in (("users", stored_users), ("data", stored_data)):
+                for user_id, value in stored.items():
+                    if user_id not in entry["removed"][table]:
+                        self.tables[table].setdefault((scope, user_id), value)
+                        entry["ids"].add(user_id)
+
+    def detach(self, scope):
+        with self.lock:
+            entry = self.scopes.get(scope)
+            if entry is None:
+                return
+            entry["pages"] -= 1
+            if entry["pages"] <= 0:
+                del self.scopes[scope]
+                for user_id in entry["ids"]:
+                    self.user_locks.pop((scope, user_id), None)
+                    for table in self.tables.values():
+                        table.pop((scope, user_id), None)
+
+    def ids(self, scope):
+        """Snapshot of the scope's account ids"""
+        with self.lock:
+            entry = self.scopes.get(scope)
+            return set(entry["ids"]) if entry else set()
+
+    def put(self, table, scope, user_id, value):
+        with self.lock:
+            entry = self.scopes.get(scope)
+            if entry is not None:
+                entry["ids"].add(user_id)
+                entry["removed"][table].discard(user_id)
+            self.tables[table][(scope, user_id)] = value
+
+    def remove(self, table, scope, user_id):
+        with self.lock:
+            del self.tables[table][(scope, user_id)]
+            entry = self.scopes.get(scope)
+            if entry is not None:
+                # Remembered so merging with the stored copy doesn't bring it back
+                entry["removed"][table].add(user_id)
+
+    def removed(self, table, scope):
+        with self.lock:
+            entry = self.scopes.get(scope)
+            return set(entry["removed"][table]) if entry else set()
+
+    def lock_for(self, scope, user_id):
+        """Per-account write lock (re-entrant)"""
+        with self.lock:
+            return self.user_locks.setdefault((scope, user_id), threading.RLock())
+
+    def resident_count(self):
+        with self.lock:
+            return sum(len(entry["ids"]) for entry in self.scopes.values())
+
+class AccountView(MutableMapping):
+    """A page's dict-like window onto one table of the shared store: its scope's accounts"""
+    def __init__(self, store, table, scope):
+        self.store = store
+        self.name = table
+        self.table = store.tables[table]
+        self.scope = scope
+
+    def __getitem__(self, user_id):
+        return self.table[(self.scope, user_id)]
+
+    def __setitem__(self, user_id, value):
+        self.store.put(self.name, self.scope, user_id, value)
+
+    def __delitem__(self, user_id):
+        if (self.scope, user_id) not in self.table:
+            raise KeyError(user_id)
+        self.store.remove(self.name, self.scope, user_id)
+
+    def __iter__(self):
+        return iter([user_id for user_id in self.store.ids(self.scope) if (self.scope, user_id) in self.table])
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def to_dict(self):
+        """Plain dict of the scope's accounts"""
+        return {user_id: self.table[(self.scope, user_id)] for user_id in self}
+
+    def merged_dict(self, stored):
+        """to_dict() over the stored dict: entries another writer stored are kept
+        unless they were removed here"""
+        removed = self.store.removed(self.name, self.scope)
+        merged = {user_id: value for user_id, value in stored.items() if user_id not in removed}
+        merged.update(self.to_dict())
+        return merged
+
+_shared_accounts = None
+_shared_accounts_lock = threading.Lock()
+
+def shared_accounts():
+    global _shared_accounts
+    with _shared_accounts_lock:
+        if _shared_accounts is None:
+            _shared_accounts = SharedAccountStore()
+        return _shared_accounts
+
+# --- Persistent Item Lists ---
+class ItemVector:
+    """Immutable list of a user's items; every update returns a new version.
+
+    Stored as a 32-way trie of tuples, so append/remove copy only the O(log32 n)
+    nodes on one path and share the rest with the previous version. Taking a
+    snapshot is just keeping the reference: a background sync can serialize it
+    while the UI keeps producing newer versions. Removed slots become holes that
+    iteration skips; the trie is rebuilt once holes outnumber the live items.
+
+    Slots never move between versions (until a rebuild), so one identity index
+    {id(item): slot} is shared by a vector's versions and lets remove/replace
+    find an item in O(log n). A hit is confirmed with an identity check on the
+    slot; a miss (an item added on another branch) falls back to a scan.
+    """
+    BITS = 5
+    WIDTH = 1 << BITS
+    MASK = WIDTH - 1
+    _HOLE = object()
+
+    __slots__ = ("root", "shift", "size", "holes", "index")
+
+    def __init__(self, items=()):
+        # Bottom-up build: O(n) instead of n appends
+        if not isinstance(items, (list, tuple)):
+            items = list(items)
+        nodes = [tuple(items[i:i + self.WIDTH]) for i in range(0, len(items), self.WIDTH)]
+        self.size = len(items)
+        self.holes = 0
+        self.shift = 0
+        while len(nodes) > 1:
+            nodes = [tuple(nodes[i:i + self.WIDTH]) for i in range(0, len(nodes), self.WIDTH)]
+            self.shift += self.BITS
+        self.root = nodes[0] if nodes else ()
+        self.index = {id(item): slot for slot, item in enumerate(items)}
+
+    def _make(self, root, shift, size, holes):
+        """New version sharing this one's identity index"""
+        vector = ItemVector.__new__(ItemVector)
+        vector.root, vector.shift, vector.size, vector.holes = root, shift, size, holes
+        vector.index = self.index
+        return vector
+
+    def _new_path(self, shift, item):
+        node = (item,)
+        for _ in range(shift // self.BITS):
+            node = (node,)
+        return node
+
+    def _push(self, node, shift, item):
+        if shift == 0:
+            return node + (item,)
+        sub = (self.size >> shift) & self.MASK
+        if sub < len(node):
+            return node[:sub] + (self._push(node[sub], shift - self.BITS, item),)
+        return node + (self._new_path(shift - self.BITS, item),)
+
+    def _assoc(self, node, shift, index, value):
+        sub = (index >> shift) & self.MASK
+        child = value if shift == 0 else self._assoc(node[sub], shift - self.BITS, index, value)
+        return node[:sub] + (child,) + node[sub + 1:]
+
+    def append(self, item):
+        """New version with item added at the end"""
+        self.index[id(item)] = self.size
+        if self.size == self.WIDTH << self.shift:
+            # Root is full: grow the trie one level
+            root = (self.root, self._new_path(self.shift, item))
+            return self._make(root, self.shift + self.BITS, self.size + 1, self.holes)
+        return self._make(self._push(self.root, self.shift, item), self.shift, self.size + 1, self.holes)
+
+    def _get(self, slot):
+        node = self.root
+        for shift in range(self.shift, 0, -self.BITS):
+            node = node[(slot >> shift) & self.MASK]
+        return node[slot & self.MASK]
+
+    def _slot_of(self, item):
+        slot = self.index.get(id(item))
+        if slot is not None and slot < self.size and self._get(slot) is item:
+            return slot
+        for slot, candidate in enumerate(self._slots()):
+            if candidate is item:
+                return slot
+        return None
+
+    def remove(self, item):
+        """New version without item (matched by identity); self if it is not present"""
+        slot = self._slot_of(item)
+        if slot is None:
+            return self
+        holes = self.holes + 1
+        if holes * 2 > self.size:
+            # Amortized over the removals that made the holes
+            return ItemVector([other for other in self if other is not item])
+        # Older versions still holding item fall back to a scan
+        self.index.pop(id(item), None)
+        return self._make(self._assoc(self.root, self.shift, slot, self._HOLE), self.shift, self.size, holes)
+
+    def replace(self, item, new_item):
+        """New version with item (matched by identity) swapped for new_item"""
+        slot = self._slot_of(item)
+        if slot is None:
+            return self
+        self.index.pop(id(item), None)
+        self.index[id(new_item)] = slot
+        return self._make(self._assoc(self.root, self.shift, slot, new_item), self.shift, self.size, self.holes)
+
+    def _slots(self):
+        stack = [(self.root, self.shift)]
+        while stack:
+            node, shift = stack.pop()
+            if shift == 0:
+                yield from node
+            else:
+                stack.extend((child, shift - self.BITS) for child in reversed(node))
+
+    def __iter__(self):
+        hole = self._HOLE
+        return (item for item in self._slots() if item is not hole)
+
+    def __len__(self):
+        return self.size - self.holes
+
+    def __repr__(self):
+        return f"ItemVector({list(self)!r})"
+
+def json_default(obj):
+    """json.dumps hook: ItemVector snapshots serialize as plain lists"""
+    if isinstance(obj, ItemVector):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+# --- Encrypted Backups ---
+# Stream format (decryption_tool/decrypt_viewer.py reads it, and the older
+# single-token format): one JSON header line with the KDF parameters and salt,
+# then one Fernet token per line. Each token encrypts (chunk index, last flag,
+# up to chunk_bytes of the backup JSON), so every chunk is authenticated on its
+# own and dropped, reordered or truncated chunks are detected.
+BACKUP_FORMAT = "interest-calculator-backup"
+BACKUP_VERSION = 2
+BACKUP_KDF_ITERATIONS = 100000
+BACKUP_CHUNK_BYTES = 64 * 1024
+BACKUP_FRAME = struct.Struct(">IB")  # chunk index, 1 on the last chunk
+
+def backup_key(password, salt, iterations=BACKUP_KDF_ITERATIONS):
+    """Fernet key for a backup password (PBKDF2-SHA256)"""
+    kdf = hashlib.pbkdf2_hmac('sha256', password.encode(), salt, iterations)
+    return base64.urlsafe_b64encode(kdf)
+
+def backup_key_check(key):
+    """Stored in the header so a wrong password is told apart from a corrupt chunk"""
+    return hmac.new(key, b"backup-key-check", hashlib.sha256).hexdigest()
+
+class BackupWriter:
+    """Encrypts a byte stream into the chunked backup format, one chunk in memory at a time"""
+    def __init__(self, fileobj, password, chunk_bytes=BACKUP_CHUNK_BYTES, iterations=BACKUP_KDF_ITERATIONS):
+        self.file = fileobj
+        self.chunk_bytes = chunk_bytes
+        self.buffer = bytearray()
+        self.index = 0
+        salt = os.urandom(16)
+        key = backup_key(password, salt, iterations)
+        self.fernet = Fernet(key)
+        header = {
+            "format": BACKUP_FORMAT,
+            "version": BACKUP_VERSION,
+            "is_encrypted": True,
+            "kdf": "pbkdf2_sha256",
+            "iterations": iterations,
+            "salt": base64.b64encode(salt).decode(),
+            "key_check": backup_key_check(key),
+            "chunk_bytes": chunk_bytes,
+        }
+        self.file.write(json.dumps(header).encode('utf-8') + b"\n")
+
+    def write(self, data):
+        self.buffer += data
+        # Strictly greater: the final (flagged) chunk is written by close()
+        while len(self.buffer) > self.chunk_bytes:
+            self._emit(bytes(self.buffer[:self.chunk_bytes]), last=False)
+            del self.buffer[:self.chunk_bytes]
+
+    def close(self):
+        self._emit(bytes(self.buffer), last=True)
+        self.buffer = bytearray()
+
+    def _emit(self, payload, last):
+        token = self.fernet.encrypt(BACKUP_FRAME.pack(self.index, int(last)) + payload)
+        self.file.write(token + b"\n")
+        self.index += 1
+
+def backup_document(fields, items):
+    """Backup JSON as a stream of byte pieces: fields first, then items one at a time"""
+    head = json.dumps(dict(fields, items=[]))
+    yield head[:-len("[]}")].encode('utf-8') + b"["
+    for i, item in enumerate(items):
+        yield (b"," if i else b"") + json.dumps(item, default=json_default).encode('utf-8')
+    yield b"]}"
+
+BACKUP_DOWNLOAD_TTL = 600  # seconds a web download link stays valid
+# Web downloads are served from here (Flet's public assets directory)
+WEB_EXPORTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "assets", "exports")
+
+def backup_filename(user_id, encrypted):
+    """Export file name; the user ID is reduced to characters safe in any path"""
+    safe_id = re.sub(r"[^A-Za-z0-9_-]+", "_", user_id).strip("_")[:64] or "user"
+    kind = "backup_encrypted" if encrypted else "backup"
+    return f"{safe_id}_{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+
+def exports_dir():
+    """exports/ under the app's data directory (FLET_APP_STORAGE_DATA in packaged apps)"""
+    base = os.environ.get("FLET_APP_STORAGE_DATA") or os.path.dirname(os.path.abspath(__file__))
+    path = os.path.join(base, "exports")
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def purge_web_exports(max_age=BACKUP_DOWNLOAD_TTL):
+    """Remove web download folders older than max_age.
+
+    Each export also schedules its own removal, but that timer does not survive
+    a restart; this catches whatever it left behind.
+    """
+    try:
+        names = os.listdir(WEB_EXPORTS_DIR)
+    except OSError:
+        return
+    cutoff = time.time() - max_age
+    for name in names:
+        path = os.path.join(WEB_EXPORTS_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    os.remove(path)
+        except OSError as e:
+            print(f"Export cleanup error: {e}")
+
+def write_backup(fileobj, fields, items, password=None):
+    """Stream a backup to a binary file; encrypted (chunked format) when a password is given.
+
+    Returns True if the backup was encrypted.
+    """
+    if password and CRYPTO_AVAILABLE:
+        writer = BackupWriter(fileobj, password)
+        for piece in backup_document(fields, items):
+            writer.write(piece)
+        writer.close()
+        return True
+    for piece in backup_document(dict(fields, is_encrypted=False), items):
+        fileobj.write(piece)
+    return False
+
+# --- Delta Sync (Dirty Record Tracking) ---
+def new_item_id():
+    return secrets.token_hex(8)
+
+def ensure_item_ids(items):
+    """Give legacy items an id/version so they can be synced individually"""
+    changed = False
+    for item in items:
+        if "id" not in item:
+            item["id"] = new_item_id()
+            changed = True
+        if "version" not in item:
+            item["version"] = 1
+            changed = True
+    return changed
+
+def chunk_manifest(snapshot):
+    """The chunk manifest of a chunked user_data row, or None for a plain snapshot.
+
+    Chunked rows carry only {"manifest": {...}} (profile included), so app
+    versions without chunk support find neither profile nor items and leave the
+    account alone instead of adopting, and later pushing back, an empty list.
+    """
+    if not isinstance(snapshot, dict):
+        return None
+    if isinstance(snapshot.get("manifest"), dict):
+        return snapshot["manifest"]
+    if snapshot.get("chunks"):
+        return snapshot  # first chunked format: manifest fields at the top level
+    return None
+
+def apply_records(package, records):
+    """Overlay per-record delta rows onto a full {"profile", "items"} package"""
+    if not records:
+        return package
+    if isinstance(package, list):
+        package = {"profile": None, "items": package}
+    profile = package.get("profile")
+    items = {item.get("id") or f"legacy:{i}": item for i, item in enumerate(package.get("items", []))}
+
+    for record in records:
+        key = record.get("record_key", "")
+        version = record.get("version", 0)
+        if key == "profile":
+            if not record.get("deleted") and (not profile or version > profile.get("version", 0)):
+                profile = record["data"]
+        elif key.startswith("item:"):
+            item_id = key[len("item:"):]
+            current = items.get(item_id)
+            if current and current.get("version", 0) >= version:
+                continue
+            if record.get("deleted"):
+                items.pop(item_id, None)
+            else:
+                items[item_id] = record["data"]
+
+    return {"profile": profile, "items": list(items.values())}
+
+def merge_cloud_items(items, remote_items, records, dirty):
+    """Merge cloud changes into the local item list in place.
+
+    remote_items is the full cloud list (None if unchanged), records are incremental
+    delta rows. Items with unsent local changes are left alone. Returns True if changed.
+    """
+    incoming = {}  # {item_id: (version, deleted, data)}
+    if remote_items is not None and all("id" in remote for remote in remote_items):
+        remote_ids = set()
+        for remote in remote_items:
+            remote_ids.add(remote["id"])
+            incoming[remote["id"]] = (remote.get("version", 0), False, remote)
+        for item in items:
+            if "id" in item and item["id"] not in remote_ids:
+                # Missing from the full cloud copy -> deleted on another device
+                incoming[item["id"]] = (item.get("version", 0), True, None)
+    for record in records:
+        key = record.get("record_key", "")
+        if key.startswith("item:"):
+            incoming[key[len("item:"):]] = (record.get("version", 0), record.get("deleted"), record.get("data"))
+
+    changed = False
+    index = {item.get("id"): i for i, item in enumerate(items)}
+    removed = set()
+    for item_id, (version, deleted, data) in incoming.items():
+        if f"item:{item_id}" in dirty:
+            continue
+        i = index.get(item_id)
+        local_version = items[i].get("version", 0) if i is not None else -1
+        if deleted:
+            if i is not None and version >= local_version:
+                removed.add(i)
+                changed = True
+        elif i is None:
+            items.append(data)
+            changed = True
+        elif version > local_version:
+            items[i] = data
+            changed = True
+    if removed:
+        items[:] = [item for i, item in enumerate(items) if i not in removed]
+    return changed
+
+class SyncTracker:
+    """Tracks records changed since the last acknowledged cloud sync, per user.
+
+    Users with unsent changes are also kept in a durable queue (persisted with
+    the rest of the state) so pushes that failed offline resume after a restart.
+    """
+    def __init__(self, storage, key="sync_state", status_key="sync_status", max_queued=50):
+        self.storage = storage
+        self.key = key
+        self.status_key = status_key
+        self.max_queued = max_queued
+        self.lock = threading.Lock()
+        self.state = {}  # {user_id: {"baseline": bool, "dirty": {record_key: version}, "queued_at": ts}}
+        self.last_success = None
+        try:
+            stored = storage.get(key)
+            if stored:
+                self.state = json.loads(stored)
+            status = storage.get(status_key)
+            if status:
+                self.last_success = json.loads(status).get("last_success")
+        except Exception as e:
+            print(f"Error loading sync state: {e}")
+
+    def _user(self, user_id):
+        return self.state.setdefault(user_id, {"baseline": False, "dirty": {}})
+
+    def _save(self):
+        try:
+            self.storage.set(self.key, json.dumps(self.state))
+        except Exception as e:
+            print(f"Error saving sync state: {e}")
+
+    def _settle(self, user):
+        # Leave the queue once nothing is left to send
+        if user["baseline"] and not user["dirty"]:
+            user.pop("queued_at", None)
+
+    def mark(self, user_id, record_key, version):
+        """Mark a record ("profile" or "item:<id>") as changed at the given version"""
+        with self.lock:
+            self._user(user_id)["dirty"][record_key] = version
+            self._save()
+
+    def require_full(self, user_id):
+        """Force the next push for this user to be a full resync"""
+        with self.lock:
+            self._user(user_id)["baseline"] = False
+            self._save()
+
+    def enqueue(self, user_id):
+        """Queue a user for pushing (one entry per user, oldest dropped past the cap)"""
+        with self.lock:
+            user = self._user(user_id)
+            if not user.get("queued_at"):
+                user["queued_at"] = time.time()
+                queued = sorted((u["queued_at"], uid) for uid, u in self.state.items() if u.get("queued_at"))
+                for _, uid in queued[:max(0, len(queued) - self.max_queued)]:
+                    # Dirty records stay tracked; they go out with that user's next sync
+                    self.state[uid].pop("queued_at", None)
+            self._save()
+
+    def settle(self, user_id):
+        with self.lock:
+            self._settle(self._user(user_id))
+            self._save()
+
+    def queued_users(self):
+        """Users with unsent changes, oldest first"""
+        with self.lock:
+            queued = sorted((u["queued_at"], uid) for uid, u in self.state.items() if u.get("queued_at"))
+            return [uid for _, uid in queued]
+
+    def pending_count(self):
+        """Number of unsent changes across queued users (a pending full resync counts as one)"""
+        with self.lock:
+            return sum(len(u["dirty"]) or 1 for u in self.state.values() if u.get("queued_at"))
+
+    def pending(self, user_id):
+        """Return (needs_full_sync, {record_key: version}) for this user"""
+        with self.lock:
+            user = self._user(user_id)
+            return not user["baseline"], dict(user["dirty"])
+
+    def cursor(self, user_id):
+        """Cloud updated_at cursor from this user's last pull"""
+        with self.lock:
+            return self._user(user_id).get("cursor")
+
+    def set_cursor(self, user_id, cursor):
+        with self.lock:
+            self._user(user_id)["cursor"] = cursor
+            self._save()
+
+    def ack(self, user_id, sent, full=False):
+        """Clear records the server acknowledged, unless they changed again since"""
+        with self.lock:
+            user = self._user(user_id)
+            for record_key, version in sent.items():
+                if user["dirty"].get(record_key) == version:
+                    del user["dirty"][record_key]
+            if full:
+                user["baseline"] = True
+            self._settle(user)
+            self._save()
+            self.last_success = time.time()
+            try:
+                self.storage.set(self.status_key, json.dumps({"last_success": self.last_success}))
+            except Exception as e:
+                print(f"Error saving sync status: {e}")
+
+# --- Online Sync (Standard Lib - No Dependencies) ---
+class ConnectionPool:
+    """Small pool of keep-alive HTTP(S) connections to a single host"""
+    def __init__(self, base_url, size=2, timeout=10):
+        parts = urllib.parse.urlsplit(base_url)
+        self.https = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.base_path = parts.path.rstrip("/")
+        self.timeout = timeout
+        self.idle = deque()
+        self.active = set()  # connections with a request in flight
+        self.aborted = False
+        self.lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(size)
+
+    def _connect(self, timeout):
+        if self.https:
+            return http.client.HTTPSConnection(self.host, self.port, timeout=timeout, context=ssl.create_default_context())
+        return http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def _checkout(self, timeout):
+        with self.lock:
+            if self.aborted:
+                raise ConnectionAbortedError("Sync cancelled")
+            conn, reused = (self.idle.pop(), True) if self.idle else (self._connect(timeout), False)
+            self.active.add(conn)
+            return conn, reused
+
+    def _checkin(self, conn):
+        with self.lock:
+            self.active.discard(conn)
+            if not self.aborted:
+                self.idle.append(conn)
+                return
+        conn.close()
+
+    def request(self, method, path, body=None, headers=None, timeout=None):
+        """Send a request on a pooled connection, returning (status, body bytes)"""
+        timeout = timeout or self.timeout
+        with self.slots:
+            conn, reused = self._checkout(timeout)
+            while True:
+                try:
+                    conn.timeout = timeout
+                    if conn.sock:
+                        conn.sock.settimeout(timeout)
+                    conn.request(method, self.base_path + path, body=body, headers=headers or {})
+                    response = conn.getresponse()
+                    data = response.read()
+                    if response.will_close:
+                        self._discard(conn)
+                    else:
+                        self._checkin(conn)
+                    return response.status, data
+                except (http.client.HTTPException, OSError):
+                    self._discard(conn)
+                    if not reused or self.aborted:
+                        raise
+                    # Server dropped an idle keep-alive connection -> reconnect once
+                    conn, reused = self._checkout(timeout)
+
+    def _discard(self, conn):
+        with self.lock:
+            self.active.discard(conn)
+        conn.close()
+
+    def close(self):
+        with self.lock:
+            while self.idle:
+                self.idle.pop().close()
+
+    def abort(self):
+        """Fail in-flight and future requests immediately (page is gone)"""
+        with self.lock:
+            self.aborted = True
+            connections = list(self.active) + list(self.idle)
+            self.idle.clear()
+        for conn in connections:
+            try:
+                # shutdown() wakes a thread blocked in recv; close() alone may not
+                if conn.sock:
+                    conn.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            conn.close()
+
+def chunk_by_size(rows, max_bytes):
+    """Group (key, encoded JSON) rows into batches whose JSON array stays under max_bytes"""
+    batch, size = [], 2
+    for row in rows:
+        row_size = len(row[1]) + 1
+        if batch and size + row_size > max_bytes:
+            yield batch
+            batch, size = [], 2
+        batch.append(row)
+        size += row_size
+    if batch:
+        yield batch
+
+def content_defined_chunks(encoded_items, target_bytes):
+    """Split encoded items into runs of about target_bytes at content-defined boundaries.
+
+    A chunk ends after an item whose hash falls below a threshold proportional to
+    its size, so boundaries depend on the items themselves rather than on their
+    position: an insert or delete only changes the chunk it lands in (and at
+    most its neighbour), not every chunk after it. Sizes stay within 1/4..4x target.
+    """
+    min_bytes, max_bytes = target_bytes // 4, target_bytes * 4
+    chunk, size = [], 0
+    for item in encoded_items:
+        chunk.append(item)
+        size += len(item) + 1
+        cut = int.from_bytes(hashlib.sha256(item).digest()[:8], "big") < (len(item) << 64) // target_bytes
+        if size >= max_bytes or (size >= min_bytes and cut):
+            yield chunk
+            chunk, size = [], 0
+    if chunk:
+        yield chunk
+
+class SyncError(Exception):
+    """A sync request failed; retryable failures are retried with backoff"""
+    def __init__(self, message, retryable=True):
+        super().__init__(message)
+        self.retryable = retryable
+
+def is_retryable_status(status):
+    return status >= 500 or status in [408, 429]
+
+class SyncWorker:
+    """Long-lived background pusher for one user.
+
+    Only the newest queued push is kept: a burst of saves collapses into a single
+    upload of the latest state, and every coalesced callback gets its result.
+    A full push is never downgraded: a delta replacing it is sent as its full_send.
+    """
+    def __init__(self, name, max_retries=4, base_delay=1.0, max_delay=30.0, stats=None):
+        self.max_retries = max_retries
+        self.stats = stats
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.cond = threading.Condition()
+        self.pending = None  # (send, [callbacks], full, full_send)
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name=f"sync-{name}", daemon=True)
+        self.thread.start()
+
+    def submit(self, send, callback=None, full=False, full_send=None):
+        """Queue send() (returns a status message), replacing any unsent push.
+
+        full marks a full resync; full_send is the full-resync version of a delta
+        push, used if it replaces (or is superseding) a full one.
+        """
+        with self.cond:
+            replaced_full = bool(self.pending and self.pending[2])
+            callbacks = self.pending[1] if self.pending else []
+            if callback:
+                callbacks.append(callback)
+            self.pending = (send, callbacks, full, full_send)
+            if replaced_full:
+                self._keep_full()
+            self.cond.notify()
+
+    def _keep_full(self):
+        """Upgrade the pending push to a full one (call with cond held)"""
+        send, callbacks, full, full_send = self.pending
+        if not full:
+            self.pending = (full_send or send, callbacks, True, None)
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify()
+
+    def _take(self):
+        with self.cond:
+            while not self.pending and not self.closed:
+                self.cond.wait()
+            job, self.pending = self.pending, None
+            return job
+
+    def _run(self):
+        while True:
+            job = self._take()
+            if job is None:
+                return
+            send, callbacks, full, _ = job
+            result = self._attempt(send, callbacks, full)
+            if result is None:
+                continue
+            for callback in callbacks:
+                try:
+                    callback(result)
+                except Exception as e:
+                    print(f"Sync callback error: {e}")
+
+    def _attempt(self, send, callbacks, full=False):
+        """Run send() with exponential backoff; None if superseded or cancelled"""
+        attempt = 0
+        while True:
+            try:
+                return send()
+            except Exception as e:
+                if isinstance(e, SyncError):
+                    retryable = e.retryable
+                else:
+                    retryable = isinstance(e, (OSError, http.client.HTTPException))
+                if not retryable or attempt >= self.max_retries:
+                    print(f"Online Sync Error: {e}")
+                    if self.stats and attempt:
+                        self.stats.count_retry(gave_up=True)
+                    return f"Sync Error: {e}"
+
+            # Full jitter: sleep a random time up to the exponential cap
+            delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+            attempt += 1
+            if self.stats:
+                self.stats.count_retry()
+            print(f"Online Sync: Retry {attempt}/{self.max_retries} in {delay:.1f}s")
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending or self.closed, timeout=delay)
+                if self.closed:
+                    return None
+                if self.pending:
+                    # A newer state was queued meanwhile; it supersedes this push
+                    self.pending[1][:0] = callbacks
+                    if full:
+                        self._keep_full()
+                    return None
+
+class SyncManager:
+    # Login ID existence cache: taken IDs rarely disappear, free ones get claimed
+    EXISTS_TTL = 300
+    MISSING_TTL = 30
+    # Item lists bigger than this are uploaded in chunks of about CHUNK_BYTES
+    CHUNK_THRESHOLD = 512 * 1024
+    CHUNK_BYTES = 256 * 1024
+    # Unreferenced chunks are only deleted once this old: another device may
+    # have uploaded them for a manifest it has not committed yet
+    CHUNK_GC_GRACE = 3600
+
+    def __init__(self, url=None, key=None, timings=None, max_in_flight=2, stats=None):
+        self.enabled = False
+        self.delta_supported = True
+        self.url = ""
+        self.headers = {}
+        self.pool = None
+        self.timings = timings or SpanTimer()
+        self.stats = stats or SyncStats()
+        self.no_cursor_tables = set()  # tables without an updated_at column
+        self.cursors = {}  # {user_id: cursor from the last pull_data}
+        self.exists_cache = {}  # {user_id: (exists, expires_at)}
+        self.exists_lock = threading.Lock()
+        self.workers = {}  # {user_id: SyncWorker}
+        self.workers_lock = threading.Lock()
+        self.max_in_flight = max_in_flight
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="sync-io")
+        try:
+            # CREDENTIALS
+            URL = url or "https://jlidoznndxqhvtvgwqnj.supabase.co"
+            KEY = key or "sb_publishable_8RX9HzSr7aKQfh6WTjlSqg_n6tlaYDF"
+            
+            if "YOUR_" not in URL:
+                self.url = URL
+                self.headers = {
+                    "apikey": KEY,
+                    "Authorization": f"Bearer {KEY}",
+                    "Content-Type": "application/json",
+                    "Prefer": "resolution=merge-duplicates"
+                }
+                # Pool size doubles as the cap on concurrent requests
+                self.pool = ConnectionPool(URL, size=max_in_flight)
+                self.enabled = True
+                print("Online Sync (StdLib): Enabled")
+        except Exception as e:
+            print(f"Online Sync Error (Init): {e}")
+
+    def _request(self, method, path, body=None, timeout=None):
+        """Call the REST API over the keep-alive pool, returning (status, body bytes)"""
+        if body is None or isinstance(body, bytes):
+            payload = body  # already-encoded JSON
+        else:
+            payload = json.dumps(body, default=json_default).encode('utf-8')
+        # Telemetry key: method + table, e.g. "GET user_data"
+        operation = f"{method} {path.split('?', 1)[0]}"
+        start = time.perf_counter()
+        try:
+            status, data = self.pool.request(method, f"/rest/v1/{path}", payload, self.headers, timeout)
+        except Exception as e:
+            self.stats.record(operation, (time.perf_counter() - start) * 1000, len(payload or b""), error=error_class(e))
+            raise
+        self.stats.record(operation, (time.perf_counter() - start) * 1000, len(payload or b""), len(data),
+                          error=f"HTTP {status}" if status >= 400 else None)
+        return status, data
+
+    def _worker(self, user_id):
+        with self.workers_lock:
+            if user_id not in self.workers:
+                self.workers[user_id] = SyncWorker(user_id, stats=self.stats)
+            return self.workers[user_id]
+
+    # user_chunks table: user_id text, chunk_hash text, data jsonb, updated_at timestamptz default now()
+    # (primary key user_id, chunk_hash).
+    # Large portfolios upload their items there; user_data then holds a manifest of chunk hashes.
+    def _send_chunks(self, user_id, data, encoded_items):
+        """Upload items in content-addressed chunks, then commit the manifest.
+
+        Chunk boundaries are content-defined, so after an edit only the chunks
+        around it are new. Chunks the server already has are skipped, so an
+        interrupted upload resumes where it stopped.
+        """
+        chunks = []
+        for batch in content_defined_chunks(encoded_items, self.CHUNK_BYTES):
+            body = b"[" + b",".join(batch) + b"]"
+            chunks.append((hashlib.sha256(body).hexdigest()[:32], body))
+        hashes = [chunk_hash for chunk_hash, _ in chunks]
+
+        uploaded = self._chunk_hashes(user_id)
+        self._upload_chunks(user_id, [chunk for chunk in chunks if chunk[0] not in uploaded], len(chunks))
+
+        # The manifest goes last: readers see either the old or the new portfolio, never half
+        manifest = {k: v for k, v in data.items() if k != "items"}
+        manifest.update(chunks=hashes, item_count=len(encoded_items))
+        status, _ = self._request("POST", "user_data", {"user_id": user_id, "data": {"manifest": manifest}})
+        if status not in [200, 201, 204]:
+            raise SyncError(f"HTTP {status}", retryable=is_retryable_status(status))
+
+        # Another device's cleanup may have removed a chunk we reused before the
+        # manifest landed; put any such chunk back
+        missing = set(hashes) - self._chunk_hashes(user_id)
+        if missing:
+            self._upload_chunks(user_id, [chunk for chunk in chunks if chunk[0] in missing], len(chunks))
+
+        # Drop chunks no longer referenced (best effort), past the grace period only
+        safe_id = urllib.parse.quote(f"eq.{user_id}")
+        keep = urllib.parse.quote("not.in.(" + ",".join(hashes) + ")")
+        cutoff = datetime.fromtimestamp(time.time() - self.CHUNK_GC_GRACE, timezone.utc).isoformat()
+        self._request("DELETE", f"user_chunks?user_id={safe_id}&chunk_hash={keep}&updated_at={urllib.parse.quote('lt.' + cutoff)}")
+        print(f"Online Sync: Pushed {len(chunks)} chunks for {user_id} ({len(chunks) - len(uploaded & set(hashes))} new)")
+
+    def _chunk_hashes(self, user_id):
+        """Hashes of the chunks the server holds for user_id"""
+        safe_id = urllib.parse.quote(f"eq.{user_id}")
+        status, content = self._request("GET", f"user_chunks?user_id={safe_id}&select=chunk_hash")
+        if status != 200:
+            raise SyncError(f"HTTP {status}", retryable=is_retryable_status(status))
+        return {row["chunk_hash"] for row in json.loads(content.decode('utf-8'))}
+
+    def _upload_chunks(self, user_id, chunks, total):
+        for index, (chunk_hash, body) in enumerate(chunks):
+            row = (b'{"user_id": ' + json.dumps(user_id).encode('utf-8') +
+                   b', "chunk_hash": "' + chunk_hash.encode('ascii') + b'", "data": ' + body + b'}')
+            status, _ = self._request("POST", "user_chunks?on_conflict=user_id,chunk_hash", row)
+            if status not in [200, 201, 204]:
+                raise SyncError(f"HTTP {status} (chunk {index + 1}/{len(chunks)} of {total})",
+                                retryable=is_retryable_status(status))
+
+    def _assemble_chunks(self, user_id, manifest):
+        """Rebuild a chunked snapshot's item list; None if a chunk is missing"""
+        hashes = manifest["chunks"]
+        safe_id = urllib.parse.quote(f"eq.{user_id}")
+        wanted = urllib.parse.quote("in.(" + ",".join(hashes) + ")")
+        status, content = self._request("GET", f"user_chunks?user_id={safe_id}&chunk_hash={wanted}&select=chunk_hash,data")
+        if status != 200:
+            print(f"Online Sync Pull Error: HTTP {status} (chunks)")
+            return None
+        by_hash = {row["chunk_hash"]: row["data"] for row in json.loads(content.decode('utf-8'))}
+        if any(chunk_hash not in by_hash for chunk_hash in hashes):
+            print(f"Online Sync Pull Error: Missing chunks for {user_id}")
+            return None
+        items = [item for chunk_hash in hashes for item in by_hash[chunk_hash]]
+        snapshot = {k: v for k, v in manifest.items() if k not in ["chunks", "item_count", "items"]}
+        snapshot["items"] = items
+        return snapshot
+
+    def _send_full(self, user_id, data, on_success=None):
+        items = data.get("items", [])
+        encoded_items = [json.dumps(item).encode('utf-8') for item in items]
+        if sum(len(item) + 1 for item in encoded_items) > self.CHUNK_THRESHOLD:
+            self._send_chunks(user_id, data, encoded_items)
+        else:
+            status, _ = self._request("POST", "user_data", {"user_id": user_id, "data": data})
+            if status not in [200, 201, 204]:
+                raise SyncError(f"HTTP {status}", retryable=is_retryable_status(status))
+            print(f"Online Sync: Pushed data for {user_id}")
+        self._remember_exists(user_id, True)
+        if on_success: on_success()
+        return f"Synced Successfully! ({len(data.get('items', []))} items)"
+
+    def push_data(self, user_id, data, callback=None, on_success=None):
+        if not self.enabled or not user_id: 
+            if callback: callback("Sync Disabled or Invalid User")
+            return
+        
+        self._worker(user_id).submit(lambda: self._send_full(user_id, data, on_success), callback, full=True)
+
+    def _send_batch(self, rows, results, on_user_success=None):
+        """Upsert encoded user_data rows in one request; split the batch if it is rejected"""
+        body = b"[" + b",".join(row for _, row in rows) + b"]"
+        status, _ = self._request("POST", "user_data", body)
+        if status in [200, 201, 204]:
+            for user_id, _ in rows:
+                results[user_id] = "ok"
+                self._remember_exists(user_id, True)
+                if on_user_success: on_user_success(user_id)
+            return
+        if is_retryable_status(status):
+            raise SyncError(f"HTTP {status}")
+        if len(rows) == 1:
+            results[rows[0][0]] = f"HTTP {status}"
+            return
+        # Bisect so one bad account does not fail the others
+        middle = len(rows) // 2
+        self._send_batch(rows[:middle], results, on_user_success)
+        self._send_batch(rows[middle:], results, on_user_success)
+
+    def push_many(self, packages, callback=None, on_user_success=None, max_batch_bytes=256 * 1024):
+        """Upsert several users' full packages ({user_id: data}) in as few requests as possible.
+
+        Rows go out in size-bounded batches; accounts too big for one request are
+        pushed on their own in chunks (like push_data). callback gets a per-user
+        summary and on_user_success(user_id) fires for every account the server
+        acknowledged.
+        """
+        if not self.enabled or not packages:
+            if callback: callback("Sync Disabled or Nothing to Sync")
+            return
+
+        rows, large = [], []
+        for user_id, data in packages.items():
+            row = json.dumps({"user_id": user_id, "data": data}, default=json_default).encode('utf-8')
+            if len(row) > self.CHUNK_THRESHOLD:
+                large.append(user_id)
+            else:
+                rows.append((user_id, row))
+        total = len(packages)
+        results = {}  # kept across retries so acknowledged batches are not resent
+
+        def send():
+            remaining = [row for row in rows if results.get(row[0]) != "ok"]
+            for batch in chunk_by_size(remaining, max_batch_bytes):
+                self._send_batch(batch, results, on_user_success)
+            for user_id in large:
+                if results.get(user_id) == "ok":
+                    continue
+                try:
+                    self._send_full(user_id, packages[user_id],
+                                    (lambda: on_user_success(user_id)) if on_user_success else None)
+                    results[user_id] = "ok"
+                except SyncError as e:
+                    if e.retryable:
+                        raise
+                    results[user_id] = str(e)
+            failed = [f"{user_id} ({error})" for user_id, error in results.items() if error != "ok"]
+            print(f"Online Sync: Bulk push {total - len(failed)}/{total} accounts")
+            if failed:
+                return f"Sync Error: {len(failed)} of {total} accounts failed: " + ", ".join(failed)
+            return f"Synced Successfully! ({total} accounts)"
+
+        # Bulk pushes get their own worker (key None is never a user ID)
+        self._worker(None).submit(send, callback)
+
+    def _send_delta(self, user_id, records, on_success=None, fallback=None):
+        rows = [dict(record, user_id=user_id) for record in records]
+        status, _ = self._request("POST", "user_records?on_conflict=user_id,record_key", rows)
+        if status in [200, 201, 204]:
+            print(f"Online Sync: Pushed {len(rows)} changes for {user_id}")
+            if on_success: on_success()
+            return f"Synced Successfully! ({len(rows)} changes)"
+        if status in [400, 404] and fallback:
+            # Table missing on this project -> stop trying deltas
+            print(f"Online Sync: Delta sync unavailable (HTTP {status}), using full sync")
+            self.delta_supported = False
+            return self._send_full(user_id, *fallback)
+        raise SyncError(f"HTTP {status}", retryable=is_retryable_status(status))
+
+    # user_records table: user_id text, record_key text, version int, deleted bool, data jsonb
+    # (primary key user_id, record_key). Rows overlay the user_data snapshot on pull.
+    def push_delta(self, user_id, records, callback=None, on_success=None, fallback=None):
+        """Upsert only changed profile/item records to the user_records table.
+
+        fallback is (full_package, on_success) used if the table is unavailable.
+        """
+        if not self.enabled or not user_id:
+            if callback: callback("Sync Disabled or Invalid User")
+            return
+
+        full_send = (lambda: self._send_full(user_id, *fallback)) if fallback else None
+        self._worker(user_id).submit(lambda: self._send_delta(user_id, records, on_success, fallback), callback,
+                                     full_send=full_send)
+
+    def _select(self, table, user_id, columns, since=None):
+        """GET a user's rows, only those updated after `since` where the table has updated_at.
+
+        Returns (status, rows or None).
+        """
+        # Encode params manually since urllib doesn't do it comfortably
+        # endpoint?user_id=eq.ID&select=data
+        # We need to URL encode the ID if it has special chars
+        safe_id = urllib.parse.quote(f"eq.{user_id}")
+        query = f"{table}?user_id={safe_id}&select={columns}"
+        if table not in self.no_cursor_tables:
+            cursor_query = query + ",updated_at"
+            if since:
+                cursor_query += "&updated_at=" + urllib.parse.quote(f"gt.{since}")
+            status, content = self._request("GET", cursor_query)
+            if status != 400:
+                return status, json.loads(content.decode('utf-8')) if status == 200 else None
+            # No updated_at column on this table -> always pull it in full
+            self.no_cursor_tables.add(table)
+        status, content = self._request("GET", query)
+        return status, json.loads(content.decode('utf-8')) if status == 200 else None
+
+    def _pull_records(self, user_id, since=None):
+        """Fetch per-record delta rows for a user (empty if unsupported)"""
+        status, rows = self._select("user_records", user_id, "record_key,version,deleted,data", since)
+        if status == 200:
+            return rows
+        if status in [400, 404]:
+            self.delta_supported = False
+        print(f"Online Sync Records Error: HTTP {status}")
+        return []
+
+    def pull_changes(self, user_id, cursor=None):
+        """Fetch only what changed since `cursor` ({"data": ts, "records": ts}).
+
+        Returns (snapshot or None if unchanged, delta records, new cursor), or None on error.
+        When the snapshot changed, all delta records are returned with it.
+        """
+        if not self.enabled or not user_id: return None
+        cursor = dict(cursor or {})
+        try:
+            with self.timings.span("sync.pull_changes"):
+                # The snapshot and the delta feed are independent -> fetch them concurrently
+                data_call = lambda: self._select("user_data", user_id, "data", cursor.get("data"))
+                records_call = lambda: self._pull_records(user_id, cursor.get("records")) if self.delta_supported else []
+                (status, rows), records = self.gather(data_call, records_call)
+                if status != 200:
+                    print(f"Online Sync Pull Error: HTTP {status}")
+                    return None
+
+                snapshot = None
+                if rows:
+                    snapshot = rows[0]["data"]
+                    manifest = chunk_manifest(snapshot)
+                    if manifest is not None:
+                        # Large portfolio: the row is a manifest, items live in user_chunks
+                        snapshot = self._assemble_chunks(user_id, manifest)
+                        if snapshot is None:
+                            return None
+                    cursor["data"] = rows[0].get("updated_at")
+                    if cursor.get("records") and self.delta_supported:
+                        # A changed snapshot needs the whole delta feed, not just the tail
+                        records = self._pull_records(user_id)
+
+                stamps = [record["updated_at"] for record in records if record.get("updated_at")]
+                if stamps:
+                    cursor["records"] = max(stamps)
+                return snapshot, records, cursor
+        except Exception as e:
+            print(f"Online Sync Pull Error: {e}")
+            return None
+
+    def _remember_exists(self, user_id, exists):
+        ttl = self.EXISTS_TTL if exists else self.MISSING_TTL
+        with self.exists_lock:
+            self.exists_cache[user_id] = (exists, time.time() + ttl)
+
+    def existing_user_ids(self, user_ids):
+        """Return which of user_ids have a cloud record, or None if the check failed.
+
+        Uncached IDs are looked up together in one request that selects only user_id.
+        """
+        if not self.enabled: return None
+        now = time.time()
+        with self.exists_lock:
+            cached = {uid: self.exists_cache.get(uid) for uid in user_ids}
+        unknown = [uid for uid, entry in cached.items() if not entry or entry[1] < now]
+
+        if unknown:
+            try:
+                with self.timings.span("sync.existing_user_ids"):
+                    # PostgREST list filter; quote values so spaces/commas survive
+                    values = ",".join('"' + uid.replace('\\', '\\\\').replace('"', '\\"') + '"' for uid in unknown)
+                    id_filter = urllib.parse.quote(f"in.({values})")
+                    status, content = self._request("GET", f"user_data?user_id={id_filter}&select=user_id")
+                if status != 200:
+                    print(f"Online Sync Lookup Error: HTTP {status}")
+                    return None
+                found = {row["user_id"] for row in json.loads(content.decode('utf-8'))}
+            except Exception as e:
+                print(f"Online Sync Lookup Error: {e}")
+                return None
+            for uid in unknown:
+                self._remember_exists(uid, uid in found)
+                cached[uid] = (uid in found, 0)
+
+        return {uid for uid, entry in cached.items() if entry[0]}
+
+    def pull_data(self, user_id):
+        with self.timings.span("sync.pull_data"):
+            result = self.pull_changes(user_id)
+            if not result or result[0] is None:
+                return None
+            snapshot, records, cursor = result
+            print(f"Online Sync: Pulled data for {user_id}")
+            # Remember where this pull got to so the next one can be incremental
+            self.cursors[user_id] = cursor
+            # Apply item-level changes pushed since the last full sync
+            return apply_records(snapshot, records)
+
+    def gather(self, *calls, timeout=None):
+        """Run independent blocking calls concurrently and return their results in order"""
+        futures = [self.executor.submit(call) for call in calls]
+        return [future.result(timeout=timeout) for future in futures]
+
+    def close(self):
+        """Stop sync workers once their queued push is sent and drop idle connections"""
+        with self.workers_lock:
+            for worker in self.workers.values():
+                worker.close()
+            self.workers.clear()
+        if self.pool:
+            self.pool.close()
+        self.stats.save()
+
+    def cancel(self):
+        """Abort everything still in flight (pushes stay in the offline queue).
+
+        A fresh executor and pool replace the aborted ones, so sync works again
+        if the page reconnects.
+        """
+        self.close()
+        executor = self.executor
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="sync-io")
+        executor.shutdown(wait=False, cancel_futures=True)
+        if self.pool:
+            pool, self.pool = self.pool, ConnectionPool(self.url, size=self.max_in_flight)
+            pool.abort()
+
 def main(page: ft.Page):
+    # Diagnostics: startup/login span timings
+    timings = SpanTimer()
+    startup_start = time.perf_counter()
+    timings.mark("main.enter")
+
+    # One client message per user action (see UpdateBatcher)
+    ui = UpdateBatcher(page)
+
+
     page.title = "Interest Calculator"
     page.theme_mode = ft.ThemeMode.LIGHT
     page.padding = 20
@@ -58,183 +2216,302 @@ def main(page: ft.Page):
     # Data Persistence
     DATA_FILE = "data.json"
     USERS_FILE = "users.json"
-    all_data = {}
-    all_users = {}
     current_user = [None] # List for mutable closure reference
     
     # Session Management
     SESSION_TIMEOUT = 900  # 15 minutes of inactivity
     last_activity = [time.time()]
-    session_active = [True]  # To control the thread
+    session_active = [True]  # False once the page has disconnected
+    session_key = object()  # this page's entry in the shared session scheduler
     
     def reset_session():
         """Reset the session timer on user activity"""
         last_activity[0] = time.time()
+        if session_active[0]:
+            session_scheduler().schedule(session_key, last_activity[0] + SESSION_TIMEOUT, check_session)
     
     def check_session():
-        """Background thread to check for session timeout"""
-        while session_active[0]:
-            time.sleep(60)  # Check every minute
-            if not session_active[0]:  # Check again after sleep
-                break
-            if current_user[0]:
-                elapsed = time.time() - last_activity[0]
-                if elapsed > SESSION_TIMEOUT:
-                    print(f"Session timeout: {elapsed}s > {SESSION_TIMEOUT}s")
-                    
-                    # Log out (thread-safe update)
-                    current_user[0] = None
-                    
-                    # Only attempt UI update if session is still active
-                    if not session_active[0]:
-                        break
-                    
-                    # Schedule UI update
-                    def logout_ui():
-                        try:
-                            items_list_view.controls.clear()
-                            show_login_screen()
-                            page.snack_bar = ft.SnackBar(content=ft.Text("Session expired due to inactivity"))
-                            page.snack_bar.open = True
-                            page.update()
-                        except Exception as e:
-                            # Silently handle errors during shutdown
-                            print(f"Session timeout UI update skipped: {e}")
-                    
-                    # Try to update UI, but don't fail if app is shutting down
-                    try:
-                        logout_ui()
-                    except Exception as e:
-                        print(f"Error handling timeout: {e}")
-    
-    # Start session monitor
-    session_thread = threading.Thread(target=check_session, daemon=True)
-    session_thread.start()
-    
-    # --- Online Sync (Upsert Logic) ---
-    # --- Online Sync (REST API Logic - Android Optimized) ---
-    # --- Online Sync (Standard Lib - No Dependencies) ---
-    class SyncManager:
-        def __init__(self):
-            self.enabled = False
-            self.url = ""
-            self.headers = {}
+        """Runs when the inactivity deadline passes (on the shared scheduler)"""
+        if not session_active[0] or not current_user[0]:
+            return
+        elapsed = time.time() - last_activity[0]
+        if elapsed < SESSION_TIMEOUT:
+            return
+        print(f"Session timeout: {elapsed}s > {SESSION_TIMEOUT}s")
+
+        # Log out (thread-safe update)
+        current_user[0] = None
+        # An idle device must not resume without the password
+        revoke_session_token()
+
+        # Schedule UI update
+        def logout_ui():
             try:
-                # CREDENTIALS
-                URL = "https://jlidoznndxqhvtvgwqnj.supabase.co"
-                KEY = "sb_publishable_8RX9HzSr7aKQfh6WTjlSqg_n6tlaYDF"
-                
-                if "YOUR_" not in URL:
-                    self.url = URL
-                    self.headers = {
-                        "apikey": KEY,
-                        "Authorization": f"Bearer {KEY}",
-                        "Content-Type": "application/json",
-                        "Prefer": "resolution=merge-duplicates"
-                    }
-                    self.enabled = True
-                    print("Online Sync (StdLib): Enabled")
+                items_list_view.controls.clear()
+                show_login_screen()
+                page.snack_bar = ft.SnackBar(content=ft.Text("Session expired due to inactivity"))
+                page.snack_bar.open = True
+                page.update()
             except Exception as e:
-                print(f"Online Sync Error (Init): {e}")
+                # Silently handle errors during shutdown
+                print(f"Session timeout UI update skipped: {e}")
 
-        def push_data(self, user_id, data, callback=None):
-            if not self.enabled or not user_id: 
-                if callback: callback("Sync Disabled or Invalid User")
-                return
-            
-            def _push():
-                try:
-                    import urllib.request
-                    import json
-                    
-                    endpoint = f"{self.url}/rest/v1/user_data"
-                    payload = json.dumps({"user_id": user_id, "data": data}).encode('utf-8')
-                    
-                    req = urllib.request.Request(endpoint, data=payload, method='POST')
-                    for k, v in self.headers.items():
-                        req.add_header(k, v)
-                    req.add_header("Prefer", "resolution=merge-duplicates")
-                    
-                    with urllib.request.urlopen(req, timeout=10) as response:
-                        if response.status in [200, 201, 204]:
-                            print(f"Online Sync: Pushed data for {user_id}")
-                            if callback: callback(f"Synced Successfully! ({len(data)} items)")
-                        else:
-                             print(f"Online Sync Failed: {response.status}")
-                             if callback: callback(f"Sync Error: HTTP {response.status}")
-                             
-                except Exception as e:
-                    print(f"Online Sync Error: {e}")
-                    if callback: callback(f"Sync Error: {str(e)}")
-            
-            threading.Thread(target=_push, daemon=True).start()
+        # Try to update UI, but don't fail if app is shutting down
+        try:
+            logout_ui()
+        except Exception as e:
+            print(f"Error handling timeout: {e}")
+    
+    # Rolling request telemetry, persisted across runs
+    sync_stats = SyncStats(page.client_storage)
+    sync_manager = SyncManager(timings=timings, stats=sync_stats)
+
+    # Firebase Setup
+    firebase_db = [None]
+    
+
+
+    @timings.timed("load_data")
+    def load_data():
+        try:
+            stored_data = page.client_storage.get("app_data")
+            if stored_data:
+                return json.loads(stored_data)
+        except Exception as e:
+            print(f"Error loading data: {e}")
+        return {}
+
+    def stored_accounts(key):
+        """Currently stored dict under key; save paths merge over it so other tabs' accounts survive"""
+        try:
+            stored = page.client_storage.get(key)
+            return json.loads(stored) if stored else {}
+        except Exception as e:
+            print(f"Error reading {key}: {e}")
+            return {}
+
+    # Delta Sync: records changed since the last acknowledged push
+    sync_tracker = SyncTracker(page.client_storage)
+
+    def cloud_profile(user_id):
+        profile = all_users.get(user_id, {}).copy() # Copy to avoid mutating local state safely
+        if "login_id" not in profile:
+            profile["login_id"] = user_id # Force Inject ID for legacy users
+        return profile
+
+    def mark_profile_changed(user_id):
+        with account_store.lock_for(storage_scope, user_id):
+            profile = all_users.get(user_id)
+            if profile is None: return
+            profile = dict(profile, version=profile.get("version", 0) + 1)
+            all_users[user_id] = profile
+        sync_tracker.mark(user_id, "profile", profile["version"])
+
+    def mark_item_changed(user_id, item, deleted=False):
+        # A deletion is a tombstone one version above the item it removes
+        version = item.get("version", 1) + (1 if deleted else 0)
+        sync_tracker.mark(user_id, f"item:{item['id']}", version)
+
+    def build_delta_records(user_id, dirty):
+        items_by_id = {item.get("id"): item for item in all_data.get(user_id, [])}
+        records = []
+        for record_key, version in dirty.items():
+            if record_key == "profile":
+                data = cloud_profile(user_id)
+            else:
+                data = items_by_id.get(record_key[len("item:"):])
+            records.append({
+                "record_key": record_key,
+                "version": version,
+                "deleted": data is None,
+                "data": data,
+            })
+        return records
 
-        def pull_data(self, user_id):
-            if not self.enabled or not user_id: return None
+    def build_full_package(user_id):
+        # Package Profile + Items (the ItemVector itself: an O(1) snapshot later edits cannot touch)
+        return {
+            "profile": cloud_profile(user_id),
+            "items": all_data.get(user_id, ItemVector())
+        }
+
+    def sync_user_to_cloud(user_id, callback=None, full=False):
+        if not user_id: return
+
+        # Stays queued (persisted) until the server acknowledges the push
+        sync_tracker.enqueue(user_id)
+        needs_full, dirty = sync_tracker.pending(user_id)
+        full_package = build_full_package(user_id)
+        on_full_success = lambda: sync_tracker.ack(user_id, dirty, full=True)
+
+        def on_result(result):
+            if result.startswith("Sync Error"):
+                schedule_queue_drain()
+            else:
+                drain_delay[0] = QUEUE_DRAIN_MIN_DELAY
+            if callback: callback(result)
+
+        if full or needs_full or not sync_manager.delta_supported:
+            # Push to cloud
+            sync_manager.push_data(user_id, full_package, on_result, on_success=on_full_success)
+            return
+
+        if not dirty:
+            sync_tracker.settle(user_id)
+            drain_delay[0] = QUEUE_DRAIN_MIN_DELAY
+            if callback: callback("Already up to date")
+            return
+
+        # Push only what changed; fall back to a full resync if deltas are unsupported
+        sync_manager.push_delta(
+            user_id, build_delta_records(user_id, dirty), on_result,
+            on_success=lambda: sync_tracker.ack(user_id, dirty),
+            fallback=(full_package, on_full_success),
+        )
+
+    # Offline Queue: retry queued users until the connection comes back
+    SYNC_DISCONNECT_GRACE = 10  # seconds in-flight syncs get after the page goes away
+    QUEUE_DRAIN_MIN_DELAY = 30
+    QUEUE_DRAIN_MAX_DELAY = 900
+    drain_delay = [QUEUE_DRAIN_MIN_DELAY]
+    drain_timer = [None]
+
+    def drain_sync_queue():
+        for user_id in sync_tracker.queued_users():
+            sync_user_to_cloud(user_id)
+
+    # --- Cloud Prefetch (remembered user on the landing page) ---
+    PREFETCH_MAX_AGE = 120  # seconds a prefetched pull stays usable
+    PREFETCH_WAIT = 10  # how long a login waits for a prefetch still in flight
+    prefetched = {}  # {user_id: {"done": Event, "local": bool, "cursor": ..., "result": ..., "at": time}}
+    prefetch_lock = threading.Lock()
+
+    def prefetch_cloud_data(user_id):
+        """Fetch user_id's cloud record in the background so the next login is warm"""
+        if not user_id or not sync_manager.enabled:
+            return
+        with prefetch_lock:
+            entry = prefetched.get(user_id)
+            if entry and (not entry["done"].is_set() or time.time() - entry["at"] < PREFETCH_MAX_AGE):
+                return  # in flight or still fresh
+            local = user_id in all_users
+            entry = {
+                "done": threading.Event(), "local": local, "result": None, "at": time.time(),
+                # Local freshness: a known account only needs what changed since its cursor
+                "cursor": sync_tracker.cursor(user_id) if local else None,
+            }
+            prefetched[user_id] = entry
+
+        def run():
             try:
-                import urllib.request
-                import json
-                
-                # Encode params manually since urllib doesn't do it comfortably
-                # endpoint?user_id=eq.ID&select=data
-                # We need to URL encode the ID if it has special chars
-                import urllib.parse
-                safe_id = urllib.parse.quote(f"eq.{user_id}")
-                endpoint = f"{self.url}/rest/v1/user_data?user_id={safe_id}&select=data"
-                
-                req = urllib.request.Request(endpoint, method='GET')
-                for k, v in self.headers.items():
-                    req.add_header(k, v)
-                
-                with urllib.request.urlopen(req, timeout=10) as response:
-                    if response.status == 200:
-                        content = response.read().decode('utf-8')
-                        records = json.loads(content)
-                        if records and len(records) > 0:
-                            print(f"Online Sync: Pulled data for {user_id}")
-                            return records[0]["data"]
+                with timings.span("prefetch_cloud_data"):
+                    if entry["local"]:
+                        entry["result"] = sync_manager.pull_changes(user_id, entry["cursor"])
+                    else:
+                        # Not on this device: warm the same lookups attempt_login would make
+                        existing = sync_manager.existing_user_ids([user_id, user_id + " "]) or set()
+                        if user_id in existing:
+                            entry["result"] = sync_manager.pull_data(user_id)
+                        elif user_id + " " in existing:
+                            entry["result"] = sync_manager.pull_data(user_id + " ")
             except Exception as e:
-                print(f"Online Sync Pull Error: {e}")
+                print(f"Prefetch Error: {e}")
+            finally:
+                entry["at"] = time.time()
+                entry["done"].set()
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def take_prefetched(user_id, local):
+        """Consume a fresh prefetched result for user_id, or None to fetch normally"""
+        with prefetch_lock:
+            entry = prefetched.get(user_id)
+        if not entry or entry["local"] != local or not entry["done"].wait(PREFETCH_WAIT):
+            return None
+        with prefetch_lock:
+            if prefetched.get(user_id) is entry:
+                del prefetched[user_id]
+        if time.time() - entry["at"] > PREFETCH_MAX_AGE:
             return None
+        if local and entry["cursor"] != sync_tracker.cursor(user_id):
+            return None  # pulled against an older cursor
+        return entry["result"]
 
-    sync_manager = SyncManager()
+    def refresh_user_from_cloud(user_id):
+        """Pull only what changed in the cloud since the last pull and merge it in place"""
+        result = take_prefetched(user_id, local=True)
+        if result is None:
+            result = sync_manager.pull_changes(user_id, sync_tracker.cursor(user_id))
+        if result is None:
+            return
+        snapshot, records, cursor = result
+        _, dirty = sync_tracker.pending(user_id)
 
-    # Firebase Setup
-    firebase_db = [None]
-    
+        remote_items = None
+        remote_profile = None
+        if chunk_manifest(snapshot) is not None:
+            # An unassembled manifest has no item list; it must not read as "all deleted"
+            snapshot = None
+        if snapshot is not None:
+            full_copy = apply_records(snapshot, records)
+            if isinstance(full_copy, list):
+                full_copy = {"profile": None, "items": full_copy}
+            remote_items = full_copy.get("items", [])
+            remote_profile = full_copy.get("profile")
+            records = []
+        else:
+            for record in records:
+                if record.get("record_key") == "profile" and not record.get("deleted"):
+                    remote_profile = record.get("data")
 
+        with account_store.lock_for(storage_scope, user_id):
+            # Merge into a copy, then publish it as a new version
+            items = list(all_data.get(user_id, ()))
+            items_changed = merge_cloud_items(items, remote_items, records, dirty)
+            if items_changed or user_id not in all_data:
+                all_data[user_id] = ItemVector(items)
 
-    def load_data():
+            local_profile = all_users.get(user_id)
+            profile_changed = (
+                local_profile is not None and remote_profile and "profile" not in dirty
+                and remote_profile.get("version", 0) > local_profile.get("version", 0)
+            )
+            if profile_changed:
+                all_users[user_id] = dict(local_profile, **remote_profile)
+
+        sync_tracker.set_cursor(user_id, cursor)
+
+        # Store locally without save_data(): these changes came from the cloud
         try:
-            stored_data = page.client_storage.get("app_data")
-            if stored_data:
-                return json.loads(stored_data)
+            if items_changed:
+                page.client_storage.set("app_data", json.dumps(all_data.merged_dict(stored_accounts("app_data")), default=json_default))
+            if profile_changed:
+                page.client_storage.set("app_users", json.dumps(all_users.merged_dict(stored_accounts("app_users"))))
         except Exception as e:
-            print(f"Error loading data: {e}")
-        return {}
+            print(f"Error saving pulled data: {e}")
 
-    def sync_user_to_cloud(user_id, callback=None):
-        if not user_id: return
-        
-        # Package Profile + Items
-        profile = all_users.get(user_id, {}).copy() # Copy to avoid mutating local state safely
-        if "login_id" not in profile:
-            profile["login_id"] = user_id # Force Inject ID for legacy users
-            
-        items = all_data.get(user_id, [])
-        
-        full_package = {
-            "profile": profile,
-            "items": items
-        }
-        
-        # Push to cloud
-        sync_manager.push_data(user_id, full_package, callback)
+        if items_changed and current_user[0] == user_id:
+            print(f"Online Sync: Merged cloud changes for {user_id}")
+            render_items()
+
+    def schedule_queue_drain():
+        if drain_timer[0] or not session_active[0]:
+            return
+
+        def run():
+            drain_timer[0] = None
+            if session_active[0]:
+                drain_sync_queue()
+
+        drain_timer[0] = threading.Timer(drain_delay[0], run)
+        drain_timer[0].daemon = True
+        drain_timer[0].start()
+        drain_delay[0] = min(drain_delay[0] * 2, QUEUE_DRAIN_MAX_DELAY)
 
     def save_data():
         # Save to client storage (works on Android without special perms)
         try:
-            page.client_storage.set("app_data", json.dumps(all_data))
+            page.client_storage.set("app_data", json.dumps(all_data.merged_dict(stored_accounts("app_data")), default=json_default))
             
             # Auto-Sync on save
             if current_user[0]:
@@ -246,6 +2523,7 @@ def main(page: ft.Page):
 
 
     
+    @timings.timed("load_users")
     def load_users():
         try:
             stored_users = page.client_storage.get("app_users")
@@ -258,7 +2536,7 @@ def main(page: ft.Page):
     def save_users():
         # Save to client storage (works on Android without special perms)
         try:
-            page.client_storage.set(APP_USERS_KEY, json.dumps(all_users))
+            page.client_storage.set("app_users", json.dumps(all_users.merged_dict(stored_accounts("app_users"))))
             # Auto-Sync on user profile update
             if current_user[0]:
                 sync_user_to_cloud(current_user[0])
@@ -266,6 +2544,7 @@ def main(page: ft.Page):
             print(f"Error saving users: {e}")
         
         
+    @timings.timed("migrate_legacy_data")
     def migrate_legacy_data():
         """Migrate old file-based data to client_storage"""
         # Only migrate if client_storage is empty
@@ -292,31 +2571,28 @@ def main(page: ft.Page):
     # Run migration on startup
     migrate_legacy_data()
 
-    # Load data from storage into memory
-    all_data = load_data()
-    all_users = load_users()
+    def storage_id():
+        """Random identity of this client's storage, created on first use"""
+        value = page.client_storage.get("storage_id")
+        if not value:
+            value = secrets.token_hex(16)
+            page.client_storage.set("storage_id", value)
+        return value
+
+    # Load data from storage into memory, shared with other pages on the same storage
+    account_store = shared_accounts()
+    storage_scope = storage_id()
+    stored_data = {user_id: ItemVector(items) for user_id, items in load_data().items()}
+    account_store.attach(storage_scope, load_users(), stored_data)
+    accounts_attached = [True]
+    all_data = AccountView(account_store, "data", storage_scope)
+    all_users = AccountView(account_store, "users", storage_scope)
     print(f"Loaded {len(all_users)} users and data for {len(all_data)} accounts.")
     
 
 
     
-    # Security Functions
-    def hash_password(password):
-        """Hash password with salt using PBKDF2"""
-        salt = secrets.token_hex(16)
-        pwd_hash = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
-        return f"{salt}${pwd_hash.hex()}"
-    
-    def verify_password(stored_password, provided_password):
-        """Verify password against stored hash"""
-        try:
-            salt, pwd_hash = stored_password.split('$')
-            new_hash = hashlib.pbkdf2_hmac('sha256', provided_password.encode(), salt.encode(), 100000)
-            return new_hash.hex() == pwd_hash
-        except:
-            # Fallback for old plain-text passwords (migration)
-            return stored_password == provided_password
-    
+    # Security Functions (hash_password / verify_password are module-level)
     def validate_email(email):
         """Validate email format"""
         pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
@@ -341,30 +2617,32 @@ def main(page: ft.Page):
             return False, "Password must contain at least one number"
         return True, "Strong password"
     
-    # Rate Limiting
-    login_attempts = {}  # {username: [timestamp1, timestamp2, ...]}
-    
+    # Rate Limiting (limits from config.json "rate_limit")
+    def client_key():
+        """Identify this client for per-client limits (config rate_limit.client_key).
+
+        "ip" (default) uses the IP on the web, else the session. Behind a reverse
+        proxy every user shares the proxy's IP and so one budget: use "session"
+        there, or "off" to rely on the per-user limit alone.
+        """
+        mode = config.get("rate_limit", {}).get("client_key", "ip")
+        if mode == "off":
+            return None
+        if mode == "session":
+            return page.session_id or "local"
+        return page.client_ip or page.session_id or "local"
+
     def check_rate_limit(username):
-        """Check if user has exceeded login attempt limit"""
-        now = time.time()
-        if username in login_attempts:
-            # Remove attempts older than 15 minutes
-            login_attempts[username] = [t for t in login_attempts[username] if now - t < 900]
-            
-            if len(login_attempts[username]) >= 5:
-                return False, "Too many login attempts. Please try again in 15 minutes."
-        return True, ""
+        """Check if user or client has exceeded login attempt limit"""
+        return login_limiter.check(username, client_key())
     
     def record_login_attempt(username):
-        """Record a login attempt"""
-        if username not in login_attempts:
-            login_attempts[username] = []
-        login_attempts[username].append(time.time())
+        """Record a failed login attempt"""
+        login_limiter.record_failure(username, client_key())
     
     def clear_login_attempts(username):
         """Clear login attempts after successful login"""
-        if username in login_attempts:
-            login_attempts[username] = []
+        login_limiter.clear(username)
     
     # Export/Import Functions
     encryption_password_field = ft.TextField(label="Encryption Password (Optional)", password=True, can_reveal_password=True)
@@ -373,6 +2651,16 @@ def main(page: ft.Page):
     
     # Export Data Storage (Mutable)
     current_export_data = [None]
+    pending_backup = [None]  # writer waiting for the desktop save dialog
+
+    def on_backup_picker_result(e):
+        write_to, pending_backup[0] = pending_backup[0], None
+        if write_to and e.path:
+            path = e.path if e.path.lower().endswith(".json") else e.path + ".json"
+            threading.Thread(target=write_to, args=(path,), daemon=True).start()
+
+    backup_picker = ft.FilePicker(on_result=on_backup_picker_result)
+    page.overlay.append(backup_picker)
     
 
     
@@ -387,14 +2675,62 @@ def main(page: ft.Page):
         return {"email": {"enabled": False}, "sms": {"enabled": False}}
     
     config = load_config()
+    login_limiter = shared_login_limiter(config.get("rate_limit", {}))
+
+    # PBKDF2 cost for new/upgraded hashes, per device class (see config_template.json)
+    is_mobile = page.platform in [ft.PagePlatform.ANDROID, ft.PagePlatform.IOS]
+    iteration_settings = config.get("security", {}).get("password_iterations", {})
+    password_iterations = int(iteration_settings.get("mobile" if is_mobile else "desktop", DEFAULT_PASSWORD_ITERATIONS))
+
+    # Remembered-user resume window (hours, 0 disables session tokens)
+    SESSION_RESUME_SECONDS = int(float(config.get("security", {}).get("session_resume_hours", 24)) * 3600)
+
+    def session_secret():
+        """Per-device signing secret, created on first use"""
+        secret = page.client_storage.get("session_secret")
+        if not secret:
+            secret = secrets.token_hex(32)
+            page.client_storage.set("session_secret", secret)
+        return secret
+
+    def save_session_token(username):
+        if not SESSION_RESUME_SECONDS or username not in all_users:
+            return
+        try:
+            token = issue_session_token(session_secret(), username, all_users[username]["password"], SESSION_RESUME_SECONDS)
+            page.client_storage.set("session_token", token)
+        except Exception as e:
+            print(f"Error saving session token: {e}")
+
+    def resumable_session(username):
+        """True if a valid stored session token exists for username"""
+        if not SESSION_RESUME_SECONDS or username not in all_users:
+            return False
+        try:
+            token = page.client_storage.get("session_token")
+            payload = read_session_token(token) if token else None
+            if not payload or payload.get("user") != username:
+                return False
+            return verify_session_token(session_secret(), token, all_users[username]["password"]) is not None
+        except Exception as e:
+            print(f"Error reading session token: {e}")
+            return False
+
+    def revoke_session_token():
+        try:
+            page.client_storage.remove("session_token")
+        except Exception as e:
+            print(f"Error revoking session token: {e}")
 
 
     
     # OTP Storage
-    otp_storage = {}  # {email/phone: {"otp": "123456", "timestamp": ...}}
+    OTP_TTL = 600  # 10 minutes, as promised in the email
+    otp_storage = OtpStore(ttl=OTP_TTL)  # keyed by phone (registration) or login ID (2FA)
     
     # Verification Functions
-    def send_email_otp(email, otp):
+    def send_email_otp(email, otp, on_result=None):
+        """Queue the OTP email; returns at once, on_result(ok, message) fires after delivery"""
         if not config.get("email", {}).get("enabled", False):
             print(f"[DEMO MODE] Email OTP for {email}: {otp}")
             return True
@@ -407,49 +2743,49 @@ def main(page: ft.Page):
             
             body = f"""Your verification code is: {otp}
             
-This code will expire in 10 minutes.
+This code will expire in {OTP_TTL // 60} minutes.
             
 If you didn't request this code, please ignore this email."""
             
             msg.attach(MIMEText(body, 'plain'))
             
-            server = smtplib.SMTP(config["email"]["smtp_server"], config["email"]["smtp_port"])
-            server.starttls()
-            server.login(config["email"]["sender_email"], config["email"]["sender_password"])
-            server.send_message(msg)
-            server.quit()
+            # Delivered by a background worker over a kept-alive SMTP connection
+            shared_mailer(config["email"]).send(msg, on_result)
             return True
         except Exception as e:
             print(f"Email error: {e}")
             return False
     
-    def send_sms_otp(phone, otp):
+    def send_sms_otp(phone, otp, on_result=None):
+        """Queue the OTP SMS; returns at once, on_result(ok, message) fires after delivery"""
         if not config.get("sms", {}).get("enabled", False):
             print(f"[DEMO MODE] SMS OTP for {phone}: {otp}")
             return True
         
         try:
-            from twilio.rest import Client
-            client = Client(
-                config["sms"]["twilio_account_sid"],
-                config["sms"]["twilio_auth_token"]
-            )
-            
-            message = client.messages.create(
-                body=f"Your Interest Calculator verification code is: {otp}",
-                from_=config["sms"]["twilio_phone"],
-                to=phone
+            shared_sms_dispatcher(config["sms"]).send(
+                phone,
+                f"Your Interest Calculator verification code is: {otp}",
+                callback=on_result,
+                stats=sync_stats,
+                expires_at=time.time() + OTP_TTL,
             )
             return True
-        except ImportError:
-            print(f"[ANDROID] Twilio not available. SMS OTP for {phone}: {otp}")
-            return True  # Return True in demo mode
         except Exception as e:
             print(f"SMS error: {e}")
             return False
     
     def generate_otp():
         return str(random.randint(100000, 999999))
+
+    def report_otp_delivery(ok, message):
+        """Show the background delivery result of an OTP message"""
+        page.snack_bar = ft.SnackBar(
+            content=ft.Text("Verification code sent" if ok else f"Could not send code: {message}"),
+            bgcolor=ft.Colors.GREEN if ok else ft.Colors.RED,
+        )
+        page.snack_bar.open = True
+        page.update()
     
     # Firebase Initialization (moved to top of main)
 
@@ -640,6 +2976,7 @@ If you didn't request this code, please ignore this email."""
             page.open(page.dialog)
 
         def delete_this(e):
+            @ui.batched("confirm_delete")
             def confirm_delete(e):
                 if current_user[0] in all_data:
                     # Find and remove the item by matching all properties
@@ -649,7 +2986,11 @@ If you didn't request this code, please ignore this email."""
                             item['amount'] == i_amount and 
                             item['rate'] == i_rate and 
                             item['date'] == i_date_str):
-                            items.pop(i)
+                            with account_store.lock_for(storage_scope, current_user[0]):
+                                # New version; a sync may still be serializing the old one
+                                all_data[current_user[0]] = all_data[current_user[0]].remove(item)
+                            if "id" in item:
+                                mark_item_changed(current_user[0], item, deleted=True)
                             save_data()
                             render_items()
                             page.close(page.dialog)
@@ -739,6 +3080,7 @@ If you didn't request this code, please ignore this email."""
     def close_add_item_dialog(e):
         page.close(add_item_dialog)
 
+    @ui.batched("save_item_click")
     def save_item_click(e):
         reset_session()
         if not current_user[0]:
@@ -758,13 +3100,15 @@ If you didn't request this code, please ignore this email."""
                 "name": item_name_field.value,
                 "amount": float(item_amount_field.value),
                 "rate": float(item_rate_field.value),
-                "date": item_date_button.text
+                "date": item_date_button.text,
+                "id": new_item_id(),
+                "version": 1
             }
             
-            if current_user[0] not in all_data:
-                all_data[current_user[0]] = []
-            
-            all_data[current_user[0]].append(item_data)
+            with account_store.lock_for(storage_scope, current_user[0]):
+                # New version; a sync may still be serializing the old one
+                all_data[current_user[0]] = all_data.get(current_user[0], ItemVector()).append(item_data)
+            mark_item_changed(current_user[0], item_data)
             save_data()
             render_items()
             
@@ -819,6 +3163,7 @@ If you didn't request this code, please ignore this email."""
     
     def show_login_screen():
         # Always show Welcome/Landing page first
+        build_landing_buttons()
         auth_view.content = landing_content
 
         auth_view.visible = True
@@ -901,12 +3246,33 @@ If you didn't request this code, please ignore this email."""
                 page.update()
                 return
 
-            # Check Global/Cloud Availability
-            print(f"Checking cloud availability for: {reg_loginid_field.value}")
-            if sync_manager.pull_data(reg_loginid_field.value) or sync_manager.pull_data(reg_loginid_field.value + " "):
-                print(f"Validation failed: Login ID '{reg_loginid_field.value}' exists globally")
+            # Check Global/Cloud Availability (off the UI thread so Register doesn't hang)
+            register_button.disabled = True
+            register_button.text = "Checking..."
+            page.update()
+            threading.Thread(target=check_registration_availability, args=(reg_loginid_field.value,), daemon=True).start()
+
+        except Exception as ex:
+            print(f"Registration Error: {ex}")
+            import traceback
+            traceback.print_exc()
+            page.snack_bar = ft.SnackBar(content=ft.Text(f"Error: {ex}"))
+            page.snack_bar.open = True
+            page.update()
+    
+
+    def check_registration_availability(login_id):
+        try:
+            print(f"Checking cloud availability for: {login_id}")
+            # One lookup covers the ID and its legacy trailing-space variant
+            existing = sync_manager.existing_user_ids([login_id, login_id + " "])
+            register_button.disabled = False
+            register_button.text = "Register"
+            if existing:
+                print(f"Validation failed: Login ID '{login_id}' exists globally")
                 reg_loginid_field.error_text = "Login ID already taken Globally"
                 reg_loginid_field.update()
+                page.update()
                 # page.snack_bar = ft.SnackBar(content=ft.Text("Login ID already taken Please choose another."))
                 # page.snack_bar.open = True
                 # page.update()
@@ -915,46 +3281,51 @@ If you didn't request this code, please ignore this email."""
                  # Clear error if valid
                  reg_loginid_field.error_text = None
                  reg_loginid_field.update()
-            
-            # Generate and send OTPs
-            # email_otp = generate_otp() # REMOVED: Email verification disabled
-            phone_otp = generate_otp()
-            
-            # otp_storage[reg_email_field.value] = {"otp": email_otp, "type": "email"}
-            otp_storage[reg_phone_field.value] = {"otp": phone_otp, "type": "phone"}
-            
-            print(f"Sending OTPs... Phone({reg_phone_field.value}): {phone_otp}")
-            
-            # Send OTPs
-            # email_sent = send_email_otp(reg_email_field.value, email_otp)
-            sms_sent = send_sms_otp(reg_phone_field.value, phone_otp)
-            
-            if not sms_sent:
-                print("Failed to send verification codes")
-                page.snack_bar = ft.SnackBar(content=ft.Text("Failed to send SMS code. Check console for OTP."))
-                page.snack_bar.open = True
-                page.update()
-            
-            # Show verification dialog
-            page.close(register_dialog)
-            # email_otp_field.value = ""
-            phone_otp_field.value = ""
-            
-            # Show OTPs for debugging/usability
-            demo_otp_text.value = f"Debug Code: Phone [{phone_otp}]"
-            
-            page.open(verify_otp_dialog)
-            demo_otp_text.update() # Update text after dialog is open
-            print("Opened verify dialog")
+
+            send_registration_otp()
 
         except Exception as ex:
+            register_button.disabled = False
+            register_button.text = "Register"
             print(f"Registration Error: {ex}")
             import traceback
             traceback.print_exc()
             page.snack_bar = ft.SnackBar(content=ft.Text(f"Error: {ex}"))
             page.snack_bar.open = True
             page.update()
-    
+
+    def send_registration_otp():
+        # Generate and send OTPs
+        # email_otp = generate_otp() # REMOVED: Email verification disabled
+        phone_otp = generate_otp()
+        
+        # otp_storage[reg_email_field.value] = {"otp": email_otp, "type": "email"}
+        otp_storage.put(reg_phone_field.value, phone_otp, type="phone")
+        
+        print(f"Sending OTPs... Phone({reg_phone_field.value}): {phone_otp}")
+        
+        # Send OTPs
+        # email_sent = send_email_otp(reg_email_field.value, email_otp)
+        sms_sent = send_sms_otp(reg_phone_field.value, phone_otp, on_result=report_otp_delivery)
+        
+        if not sms_sent:
+            print("Failed to send verification codes")
+            page.snack_bar = ft.SnackBar(content=ft.Text("Failed to send SMS code. Check console for OTP."))
+            page.snack_bar.open = True
+            page.update()
+        
+        # Show verification dialog
+        page.close(register_dialog)
+        # email_otp_field.value = ""
+        phone_otp_field.value = ""
+        
+        # Show OTPs for debugging/usability
+        demo_otp_text.value = f"Debug Code: Phone [{phone_otp}]"
+        
+        page.open(verify_otp_dialog)
+        demo_otp_text.update() # Update text after dialog is open
+        print("Opened verify dialog")
+
     demo_otp_text = ft.Text("", size=12, color=ft.Colors.BLUE)
 
     def verify_otp_click(e):
@@ -964,8 +3335,7 @@ If you didn't request this code, please ignore this email."""
         # Verify OTPs
         # email_valid = (email in otp_storage and 
         #               otp_storage[email]["otp"] == email_otp_field.value)
-        phone_valid = (phone in otp_storage and 
-                      otp_storage[phone]["otp"] == phone_otp_field.value)
+        phone_valid, otp_message = otp_storage.verify(phone, phone_otp_field.value)
         
         # if not email_valid:
         #     page.snack_bar = ft.SnackBar(content=ft.Text("Invalid Email OTP Code"))
@@ -974,44 +3344,78 @@ If you didn't request this code, please ignore this email."""
         #     return
 
         if not phone_valid:
-            page.snack_bar = ft.SnackBar(content=ft.Text("Invalid Phone OTP Code"))
+            page.snack_bar = ft.SnackBar(content=ft.Text(f"Phone OTP: {otp_message}"))
             page.snack_bar.open = True
             page.update()
             return
-        
-        # Hash password before saving
-        hashed_password = hash_password(reg_password_field.value)
-        
-        # Save user after verification
-        all_users[reg_loginid_field.value] = {
-            "name": reg_name_field.value,
-            "login_id": reg_loginid_field.value, # Explicitly store ID
-            "email": reg_email_field.value,
-            "phone": reg_phone_field.value,
-            "password": hashed_password,  # Store hashed password
-            "verified": True
-        }
-        save_users()
-        
-        # Clean up OTP storage
-        # otp_storage.pop(email, None)
-        otp_storage.pop(phone, None)
-        
-        page.close(verify_otp_dialog)
-        page.snack_bar = ft.SnackBar(content=ft.Text("Registration successful! Logging in..."))
-        page.snack_bar.open = True
+
+        # Hashing takes a while on slow phones -> do it off the UI thread
+        verify_otp_button.disabled = True
+        verify_otp_button.text = "Creating account..."
         page.update()
-        
-        # Auto-Login
-        complete_login(reg_loginid_field.value)
-        
-        # Clear registration fields
-        reg_name_field.value = ""
-        reg_email_field.value = ""
-        reg_phone_field.value = ""
-        reg_loginid_field.value = ""
-        reg_password_field.value = ""
-    
+        threading.Thread(target=finish_registration, args=(phone,), daemon=True).start()
+
+    @ui.batched("finish_registration")
+    def finish_registration(phone):
+        login_id = reg_loginid_field.value
+        stored = registered = False
+        try:
+            # Hash password before saving
+            hashed_password = hash_password(reg_password_field.value, password_iterations)
+
+            # Save user after verification
+            all_users[login_id] = {
+                "name": reg_name_field.value,
+                "login_id": login_id, # Explicitly store ID
+                "email": reg_email_field.value,
+                "phone": reg_phone_field.value,
+                "password": hashed_password,  # Store hashed password
+                "verified": True
+            }
+            stored = True
+            save_users()
+
+            # Clean up OTP storage
+            # otp_storage.pop(email, None)
+            otp_storage.discard(phone)
+            registered = True
+
+            page.close(verify_otp_dialog)
+            page.snack_bar = ft.SnackBar(content=ft.Text("Registration successful! Logging in..."))
+            page.snack_bar.open = True
+            page.update()
+
+            # Auto-Login
+            complete_login(login_id)
+
+            # Clear registration fields
+            reg_name_field.value = ""
+            reg_email_field.value = ""
+            reg_phone_field.value = ""
+            reg_loginid_field.value = ""
+            reg_password_field.value = ""
+        except Exception as ex:
+            print(f"Registration Error: {ex}")
+            import traceback
+            traceback.print_exc()
+            if registered:
+                message = f"Account created, but signing in failed: {ex}"
+            else:
+                message = f"Registration failed: {ex}"
+                if stored:
+                    # Don't leave a half-registered account behind
+                    all_users.pop(login_id, None)
+                    save_users()
+            page.snack_bar = ft.SnackBar(content=ft.Text(message))
+            page.snack_bar.open = True
+            page.update()
+        finally:
+            verify_otp_button.disabled = False
+            verify_otp_button.text = "Verify"
+            verify_otp_button.update()
+
+    verify_otp_button = ft.TextButton("Verify", on_click=verify_otp_click)
+
     verify_otp_dialog = ft.AlertDialog(
         title=ft.Text("Verify Your Account"),
         content=ft.Column(
@@ -1041,7 +3445,7 @@ If you didn't request this code, please ignore this email."""
         ),
         actions=[
             ft.TextButton("Cancel", on_click=lambda _: page.close(verify_otp_dialog)),
-            ft.TextButton("Verify", on_click=verify_otp_click),
+            verify_otp_button,
         ],
     )
     
@@ -1083,6 +3487,8 @@ If you didn't request this code, please ignore this email."""
 
     reg_password_field.on_change = update_password_status
 
+    register_button = ft.TextButton("Register", on_click=attempt_register)
+
     register_dialog = ft.AlertDialog(
         title=ft.Text("Register New Account"),
         content=ft.Column(
@@ -1099,10 +3505,18 @@ If you didn't request this code, please ignore this email."""
         ),
         actions=[
             ft.TextButton("Cancel", on_click=lambda _: page.close(register_dialog)),
-            ft.TextButton("Register", on_click=attempt_register),
+            register_button,
         ],
     )
     
+    def set_login_busy(busy, label="Login"):
+        """Progress state on the Login button while a password check runs"""
+        login_button.disabled = busy
+        login_button.text = label
+        page.update()
+
+    @timings.timed("attempt_login")
+    @ui.batched("attempt_login")
     def attempt_login(e):
         print(f"Login attempt: ID='{login_id_field.value}'")
         try:
@@ -1125,22 +3539,66 @@ If you didn't request this code, please ignore this email."""
             cleaned_id = login_id_field.value.strip()
             # Update UI to match sanitized value
             login_id_field.value = cleaned_id
-            
+
+            # Cloud lookup and PBKDF2 run off the UI thread
+            set_login_busy(True, "Signing in...")
+            threading.Thread(target=process_login, args=(cleaned_id, login_password_field.value), daemon=True).start()
+
+        except Exception as ex:
+            print(f"Login Logic Error: {ex}")
+            import traceback
+            traceback.print_exc()
+            page.snack_bar = ft.SnackBar(content=ft.Text(f"An error occurred: {str(ex)}"))
+            page.snack_bar.open = True
+            page.update()
+
+    @timings.timed("process_login")
+    @ui.batched("process_login")
+    def process_login(cleaned_id, password):
+        try:
+            verified = False  # set once the password was checked against the cloud profile
             if cleaned_id not in all_users:
                 print(f"Login failed: User '{cleaned_id}' not found locally. Checking Online...")
+
+                # Re-check: attempts started in parallel all passed attempt_login's check
+                can_attempt, rate_message = check_rate_limit(cleaned_id)
+                if not can_attempt:
+                    page.snack_bar = ft.SnackBar(content=ft.Text(rate_message))
+                    page.snack_bar.open = True
+                    page.update()
+                    return
                 
                 # Device Migration / Online Check
-                online_payload = sync_manager.pull_data(cleaned_id)
-                
-                # --- Trailing Space Recovery Logic ---
-                # If clean ID fails, check for ID + space (Legacy Fix)
-                if not online_payload:
-                     print(f"Clean ID '{cleaned_id}' not found. Checking for legacy 'space' error...")
-                     spaced_payload = sync_manager.pull_data(cleaned_id + " ")
-                     if spaced_payload:
+                # The landing page may already have fetched this account in the background
+                online_payload = take_prefetched(cleaned_id, local=False)
+                if online_payload:
+                    print("Using prefetched cloud data")
+                else:
+                    # One lightweight lookup covers the clean ID and the legacy 'space' variant
+                    existing = sync_manager.existing_user_ids([cleaned_id, cleaned_id + " "])
+                    if existing is None and sync_manager.enabled:
+                        # The lookup failed: not a wrong ID/password, so nothing is recorded
+                        page.snack_bar = ft.SnackBar(content=ft.Text("Could not reach the online server. Check your connection and try again."))
+                        page.snack_bar.open = True
+                        page.update()
+                        return
+                    existing = existing or set()
+                    if cleaned_id in existing:
+                        online_payload = sync_manager.pull_data(cleaned_id)
+
+                    # --- Trailing Space Recovery Logic ---
+                    # If clean ID fails, check for ID + space (Legacy Fix)
+                    elif cleaned_id + " " in existing:
                          print("Found data under legacy ID (with space)! recovering...")
-                         online_payload = spaced_payload
-                # -------------------------------------
+                         online_payload = sync_manager.pull_data(cleaned_id + " ")
+                    # -------------------------------------
+
+                    if existing and online_payload is None:
+                        # The account exists but its data could not be fetched
+                        page.snack_bar = ft.SnackBar(content=ft.Text("Could not reach the online server. Check your connection and try again."))
+                        page.snack_bar.open = True
+                        page.update()
+                        return
 
                 if online_payload:
                     print(f"Found online data for {cleaned_id}")
@@ -1161,11 +3619,13 @@ If you didn't request this code, please ignore this email."""
                     
                     # CASE A: Profile exists (Standard Cloud Account)
                     if profile and "password" in profile:
-                        if verify_password(profile["password"], login_password_field.value):
+                        if verify_password(profile["password"], password):
                             print("Password verified against cloud!")
                             is_authenticated = True
+                            verified = True
                         else:
                             print("Wrong password for cloud account.")
+                            record_login_attempt(cleaned_id)
                             page.snack_bar = ft.SnackBar(content=ft.Text("Incorrect Password (Cloud Account)"))
                             page.snack_bar.open = True
                             page.update()
@@ -1176,10 +3636,10 @@ If you didn't request this code, please ignore this email."""
                     elif items:
                         print("Legacy data found (No Profile). recovering account...")
                         # Create new profile with CURRENT input credentials
-                        hashed_password = hash_password(login_password_field.value)
+                        hashed_password = hash_password(password, password_iterations)
                         profile = {
-                            "name": login_id_field.value, # Default name
-                            "login_id": login_id_field.value,
+                            "name": cleaned_id, # Default name
+                            "login_id": cleaned_id,
                             "email": "",
                             "phone": "",
                             "password": hashed_password,
@@ -1187,6 +3647,7 @@ If you didn't request this code, please ignore this email."""
                             "2fa_enabled": False
                         }
                         is_authenticated = True
+                        verified = True
                     else:
                         print("User found but data is empty.")
 
@@ -1195,32 +3656,42 @@ If you didn't request this code, please ignore this email."""
                         print("Migrating data to this device...")
                         
                         # Save Locally
-                        all_users[login_id_field.value] = profile
+                        all_users[cleaned_id] = profile
                         save_users()
                         
-                        all_data[login_id_field.value] = items
+                        all_data[cleaned_id] = ItemVector(items)
+                        sync_tracker.set_cursor(cleaned_id, sync_manager.cursors.get(cleaned_id))
                         save_data() # This triggers a push, which will FIX the cloud structure
                         
                         # Proceed to standard local login below
                         pass 
                 
-                if login_id_field.value not in all_users:
-                    print(f"Login failed: User '{login_id_field.value}' not found anywhere.")
+                if cleaned_id not in all_users:
+                    print(f"Login failed: User '{cleaned_id}' not found anywhere.")
+                    record_login_attempt(cleaned_id)
                     page.snack_bar = ft.SnackBar(content=ft.Text("User ID or Password is incorrect"))
                     page.snack_bar.open = True
                     page.update()
                     return
             
             # Verify password using hash
-            user_data = all_users[login_id_field.value]
+            user_data = all_users[cleaned_id]
             stored_password = user_data["password"]
-            if not verify_password(stored_password, login_password_field.value):
+            if not verified and not verify_password(stored_password, password):
                 print("Login failed: Invalid password")
-                record_login_attempt(login_id_field.value)
+                record_login_attempt(cleaned_id)
                 page.snack_bar = ft.SnackBar(content=ft.Text("Wrong Password!"))
                 page.snack_bar.open = True
                 page.update()
                 return
+
+            # Re-hash legacy or weaker hashes now that the plain password is at hand
+            if password_needs_upgrade(stored_password, password_iterations):
+                print("Upgrading stored password hash")
+                user_data = dict(user_data, password=hash_password(password, password_iterations))
+                all_users[cleaned_id] = user_data
+                mark_profile_changed(cleaned_id)
+                save_users()
             
             # Check for 2FA
             if user_data.get("2fa_enabled", False):
@@ -1231,20 +3702,20 @@ If you didn't request this code, please ignore this email."""
                 
                 otp = generate_otp()
                 # Store temporarily for login verification
-                otp_storage[login_id_field.value] = {"otp": otp, "timestamp": time.time()}
+                otp_storage.put(cleaned_id, otp)
                 
                 # Send (try email preferably)
                 if email:
-                    send_email_otp(email, otp)
+                    send_email_otp(email, otp, on_result=report_otp_delivery)
                 if phone:
-                    send_sms_otp(phone, otp)
+                    send_sms_otp(phone, otp, on_result=report_otp_delivery)
                     
                 page.open(login_2fa_dialog)
                 return
 
             # Successful login - clear rate limit
             print("Login successful")
-            complete_login(login_id_field.value)
+            complete_login(cleaned_id)
 
         except Exception as ex:
             print(f"Login Logic Error: {ex}")
@@ -1253,8 +3724,11 @@ If you didn't request this code, please ignore this email."""
             page.snack_bar = ft.SnackBar(content=ft.Text(f"An error occurred: {str(ex)}"))
             page.snack_bar.open = True
             page.update()
+        finally:
+            set_login_busy(False)
 
-    def complete_login(username):
+    @ui.batched("complete_login")
+    def complete_login(username, resumed=False):
         clear_login_attempts(username)
         current_user[0] = username
         
@@ -1264,16 +3738,31 @@ If you didn't request this code, please ignore this email."""
         except Exception as e:
             print(f"Error saving last user: {e}")
 
+        # A resumed session keeps its original expiry
+        if not resumed:
+            save_session_token(username)
+
         reset_session()
         
 
         
         # Initialize user data if new
-        if current_user[0] not in all_data:
-            all_data[current_user[0]] = []
+        # Legacy items need ids before they can be synced individually
+        with account_store.lock_for(storage_scope, current_user[0]):
+            items = [dict(item) for item in all_data.get(current_user[0], ())]
+            needs_ids = ensure_item_ids(items)
+            if needs_ids or current_user[0] not in all_data:
+                all_data[current_user[0]] = ItemVector(items)
+        if needs_ids:
+            sync_tracker.require_full(current_user[0])
+            save_data()
         
-        render_items()
+        with timings.span("complete_login.render_items"):
+            render_items()
         show_main_app()
+
+        # Pick up changes made on other devices (incremental, off the UI thread)
+        threading.Thread(target=refresh_user_from_cloud, args=(username,), daemon=True).start()
         
         page.snack_bar = ft.SnackBar(content=ft.Text(f"Welcome {all_users[current_user[0]]['name']}!"))
         page.snack_bar.open = True
@@ -1288,14 +3777,15 @@ If you didn't request this code, please ignore this email."""
 
     login_otp_field = ft.TextField(label="Enter OTP", max_length=6, text_align=ft.TextAlign.CENTER)
 
+    @ui.batched("verify_login_otp_click")
     def verify_login_otp_click(e):
         username = login_id_field.value
-        if username in otp_storage and otp_storage[username]["otp"] == login_otp_field.value:
-            otp_storage.pop(username) # Clear OTP
+        valid, otp_message = otp_storage.verify(username, login_otp_field.value)  # consumes the code
+        if valid:
             page.close(login_2fa_dialog)
             complete_login(username)
         else:
-            page.snack_bar = ft.SnackBar(content=ft.Text("Invalid OTP"))
+            page.snack_bar = ft.SnackBar(content=ft.Text(otp_message))
             page.snack_bar.open = True
             page.update()
 
@@ -1327,6 +3817,7 @@ If you didn't request this code, please ignore this email."""
             if current_user[0]: # If logged in, then logout
                 print("Logging out...")  # Debug
                 current_user[0] = None
+                revoke_session_token()
                 items_list_view.controls.clear()
                 items_list_view.update()
                 
@@ -1368,9 +3859,75 @@ If you didn't request this code, please ignore this email."""
         on_change=handle_drawer_change,
     )
 
+    # Cloud Sync status (pending queue + last successful push)
+    sync_status_text = ft.Text("", size=12, color=ft.Colors.GREY)
+
+    def refresh_sync_status():
+        last = sync_tracker.last_success
+        last_text = datetime.fromtimestamp(last).strftime('%Y-%m-%d %H:%M') if last else "Never"
+        sync_status_text.value = f"Pending changes: {sync_tracker.pending_count()}  •  Last synced: {last_text}"
+        lines = sync_stats.summary_lines()
+        sync_stats_text.value = "\n".join(lines) if lines else "No sync requests recorded yet."
+
+    # Sync telemetry (request counts, latency, bytes, retries, errors)
+    sync_stats_text = ft.Text("", size=11, color=ft.Colors.GREY, selectable=True)
+
+    def export_sync_stats_click(e):
+        page.set_clipboard(sync_stats.to_json())
+        page.snack_bar = ft.SnackBar(content=ft.Text("Sync stats copied as JSON"))
+        page.snack_bar.open = True
+        page.update()
+
+    # Hidden Diagnostics Panel (long-press the Settings title to reveal)
+    diagnostics_text = ft.Text("", size=11, selectable=True)
+
+    def refresh_diagnostics():
+        lines = timings.summary_lines() or ["No timings recorded yet."]
+        lines.extend(ui.summary_lines())
+        limits = login_limiter.stats()
+        lines.append(f"Login limiter: {limits['tracked_users']} IDs / {limits['tracked_clients']} clients tracked, "
+                     f"rejected {limits['rejected_by_user']} by ID, {limits['rejected_by_client']} by client")
+        diagnostics_text.value = "\n".join(lines)
+
+    def toggle_diagnostics(e):
+        diagnostics_panel.visible = not diagnostics_panel.visible
+        if diagnostics_panel.visible:
+            refresh_diagnostics()
+        page.update()
+
+    def refresh_diagnostics_click(e):
+        refresh_diagnostics()
+        page.update()
+
+    def copy_diagnostics_click(e):
+        page.set_clipboard(timings.to_json())
+        page.snack_bar = ft.SnackBar(content=ft.Text("Diagnostics copied as JSON"))
+        page.snack_bar.open = True
+        page.update()
+
+    diagnostics_panel = ft.Column(
+        [
+            ft.Divider(),
+            ft.Text("Diagnostics", weight=ft.FontWeight.BOLD),
+            diagnostics_text,
+            ft.Row(
+                [
+                    ft.TextButton("Refresh", on_click=refresh_diagnostics_click),
+                    ft.TextButton("Copy JSON", on_click=copy_diagnostics_click),
+                ],
+                alignment=ft.MainAxisAlignment.CENTER,
+            ),
+        ],
+        visible=False,
+        horizontal_alignment=ft.CrossAxisAlignment.CENTER,
+    )
+
     # AppBar (store reference)
     settings_dialog = ft.AlertDialog(
-        title=ft.Text("Settings"),
+        title=ft.GestureDetector(
+            content=ft.Text("Settings"),
+            on_long_press_start=toggle_diagnostics,
+        ),
         content=ft.Column(
             [
                 ft.Text("Security", weight=ft.FontWeight.BOLD),
@@ -1386,6 +3943,9 @@ If you didn't request this code, please ignore this email."""
                 ),
                 ft.Divider(),
                 ft.Text("Cloud Sync", weight=ft.FontWeight.BOLD),
+                sync_status_text,
+                sync_stats_text,
+                ft.TextButton("Export Sync Stats", icon=ft.Icons.INSIGHTS, on_click=export_sync_stats_click),
                 ft.Container(height=10),
                 ft.ElevatedButton(
                     "Sync Now",
@@ -1394,7 +3954,22 @@ If you didn't request this code, please ignore this email."""
                     width=200,
                     style=ft.ButtonStyle(bgcolor=ft.Colors.BLUE_GREY_700, color=ft.Colors.WHITE)
                 ),
-
+                ft.OutlinedButton(
+                    "Sync All Accounts",
+                    icon=ft.Icons.CLOUD_SYNC,
+                    on_click=lambda e: sync_all_accounts_click(e),
+                    width=200,
+                ),
+                ft.Divider(),
+                ft.Text("Backup", weight=ft.FontWeight.BOLD),
+                encryption_password_field,
+                ft.OutlinedButton(
+                    "Export Backup",
+                    icon=ft.Icons.DOWNLOAD,
+                    on_click=lambda e: export_backup_click(e),
+                    width=200,
+                ),
+                diagnostics_panel,
             ],
             tight=True,
             horizontal_alignment=ft.CrossAxisAlignment.CENTER,
@@ -1430,8 +4005,111 @@ If you didn't request this code, please ignore this email."""
              page.update()
 
         # Trigger push with callback
-        sync_user_to_cloud(current_user[0], callback=on_sync_complete)
+        sync_user_to_cloud(current_user[0], callback=on_sync_complete, full=True)
     
+    @ui.batched("export_backup_click")
+    def export_backup_click(e):
+        if not current_user[0]:
+             page.snack_bar = ft.SnackBar(content=ft.Text("Please login first!"))
+             page.snack_bar.open = True
+             page.update()
+             return
+
+        user_id = current_user[0]
+        password = encryption_password_field.value or None
+        if password and not CRYPTO_AVAILABLE:
+             page.snack_bar = ft.SnackBar(content=ft.Text("Encryption is not available on this device."))
+             page.snack_bar.open = True
+             page.update()
+             return
+
+        # O(1) snapshot of the items; edits made during the export are not included
+        items = all_data.get(user_id, ItemVector())
+        profile = {k: v for k, v in cloud_profile(user_id).items() if k != "password"}
+        fields = {
+            "format": BACKUP_FORMAT,
+            "version": BACKUP_VERSION,
+            "exported_at": datetime.now().isoformat(),
+            "user_id": user_id,
+            "profile": profile,
+        }
+        filename = backup_filename(user_id, bool(password))
+
+        def run(path, download_url=None):
+            try:
+                with timings.span("export_backup"):
+                    with open(path, "wb") as f:
+                        write_backup(f, fields, items, password)
+                current_export_data[0] = path
+                if download_url:
+                    page.launch_url(download_url)
+                    message, color = "Backup ready, downloading...", ft.Colors.GREEN
+                else:
+                    message, color = f"Backup saved to {path}", ft.Colors.GREEN
+            except Exception as ex:
+                print(f"Export error: {ex}")
+                message, color = f"Export failed: {ex}", ft.Colors.RED
+            page.snack_bar = ft.SnackBar(content=ft.Text(message), bgcolor=color)
+            page.snack_bar.open = True
+            page.update()
+
+        encryption_password_field.value = ""
+        if page.web:
+            # Served from a random assets/ path, removed again after BACKUP_DOWNLOAD_TTL
+            purge_web_exports()
+            token = secrets.token_urlsafe(16)
+            folder = os.path.join(WEB_EXPORTS_DIR, token)
+            os.makedirs(folder, exist_ok=True)
+            cleanup = threading.Timer(BACKUP_DOWNLOAD_TTL, shutil.rmtree, args=(folder, True))
+            cleanup.daemon = True
+            cleanup.start()
+            args = (os.path.join(folder, filename), f"/exports/{token}/{filename}")
+        elif is_mobile:
+            args = (os.path.join(exports_dir(), filename),)
+        else:
+            # Desktop: the user picks where the backup goes
+            pending_backup[0] = run
+            backup_picker.save_file(dialog_title="Export Backup", file_name=filename, allowed_extensions=["json"])
+            page.update()
+            return
+
+        page.snack_bar = ft.SnackBar(content=ft.Text("Exporting backup..."))
+        page.snack_bar.open = True
+        page.update()
+        threading.Thread(target=run, args=args, daemon=True).start()
+
+    def sync_all_accounts_click(e):
+        if not sync_manager.enabled:
+             page.snack_bar = ft.SnackBar(content=ft.Text("Online Sync is disabled (Check keys)."))
+             page.snack_bar.open = True
+             page.update()
+             return
+
+        # Every account stored on this device, in one batched upsert
+        packages = {}
+        sent = {}
+        for user_id in set(all_users) | set(all_data):
+            sync_tracker.enqueue(user_id)
+            sent[user_id] = sync_tracker.pending(user_id)[1]
+            packages[user_id] = build_full_package(user_id)
+
+        page.snack_bar = ft.SnackBar(content=ft.Text(f"Syncing {len(packages)} accounts..."))
+        page.snack_bar.open = True
+        page.update()
+
+        def on_bulk_complete(result):
+             page.snack_bar = ft.SnackBar(
+                 content=ft.Text(result),
+                 bgcolor=ft.Colors.RED if "Error" in result else ft.Colors.GREEN,
+             )
+             page.snack_bar.open = True
+             page.update()
+
+        sync_manager.push_many(
+            packages, on_bulk_complete,
+            on_user_success=lambda user_id: sync_tracker.ack(user_id, sent[user_id], full=True),
+        )
+
     def update_2fa_setting(value):
         if not current_user[0]:
              page.snack_bar = ft.SnackBar(content=ft.Text("Please login first!"))
@@ -1440,7 +4118,9 @@ If you didn't request this code, please ignore this email."""
              return
 
         if current_user[0] in all_users:
-            all_users[current_user[0]]["2fa_enabled"] = value
+            with account_store.lock_for(storage_scope, current_user[0]):
+                all_users[current_user[0]] = dict(all_users[current_user[0]], **{"2fa_enabled": value})
+            mark_profile_changed(current_user[0])
             save_users()
             page.snack_bar = ft.SnackBar(content=ft.Text(f"2FA {'Enabled' if value else 'Disabled'}"))
             page.snack_bar.open = True
@@ -1450,6 +4130,7 @@ If you didn't request this code, please ignore this email."""
         if current_user[0] and current_user[0] in all_users:
             # Update switch value
             settings_dialog.content.controls[1].controls[1].value = all_users[current_user[0]].get("2fa_enabled", False)
+        refresh_sync_status()
         page.open(settings_dialog)
     
     app_bar = ft.AppBar(
@@ -1521,6 +4202,16 @@ If you didn't request this code, please ignore this email."""
 
     # --- Auth View & Navigation Redesign ---
 
+    login_button = ft.ElevatedButton(
+        "Login",
+        on_click=attempt_login,
+        style=ft.ButtonStyle(
+            color=ft.Colors.WHITE,
+            bgcolor=primary_color,
+        ),
+        width=200,
+    )
+
     # 1. Login Form Content (Existing - Refactored for Redesign)
     login_form_content = ft.Column(
         [
@@ -1537,15 +4228,7 @@ If you didn't request this code, please ignore this email."""
                             login_id_field,
                             login_password_field,
                             ft.Container(height=10),
-                            ft.ElevatedButton(
-                                "Login",
-                                on_click=attempt_login,
-                                style=ft.ButtonStyle(
-                                    color=ft.Colors.WHITE,
-                                    bgcolor=primary_color,
-                                ),
-                                width=200,
-                            ),
+                            login_button,
 
 
                             ft.Container(height=5),
@@ -1580,6 +4263,14 @@ If you didn't request this code, please ignore this email."""
     def quick_login_click(e):
         last_user = page.client_storage.get("last_user_id")
         if last_user:
+            # Signed session still valid -> skip the password entirely
+            if resumable_session(last_user):
+                print(f"Resuming session for {last_user}")
+                complete_login(last_user, resumed=True)
+                return
+
+            # Normally already running since the landing page appeared
+            prefetch_cloud_data(last_user)
             # Set ID and focus Password for quick entry
             login_id_field.value = last_user
             login_password_field.value = "" # Clear password
@@ -1617,7 +4308,7 @@ If you didn't request this code, please ignore this email."""
         alignment=ft.MainAxisAlignment.CENTER,
     )
 
-    def show_landing_page():
+    def build_landing_buttons():
         # Dynamic Landing Page Logic
         last_user_id = page.client_storage.get("last_user_id")
         
@@ -1683,6 +4374,13 @@ If you didn't request this code, please ignore this email."""
                 ),
              ])
 
+        # Warm the remembered account's cloud data while the user picks a button
+        if last_user_id:
+            prefetch_cloud_data(last_user_id)
+
+    @timings.timed("show_landing_page")
+    def show_landing_page():
+        build_landing_buttons()
         auth_view.content = landing_content
         auth_view.update()
 
@@ -1707,16 +4405,53 @@ If you didn't request this code, please ignore this email."""
 
 
     # Layout
-    page.on_connect = lambda e: reset_session()
+    cancel_timer = [None]  # pending sync_manager.cancel() after a disconnect
+
+    def on_page_connect(e):
+        session_active[0] = True
+        if cancel_timer[0]:
+            # Back within the grace period: keep in-flight syncs running
+            cancel_timer[0].cancel()
+            cancel_timer[0] = None
+        if not accounts_attached[0]:
+            # Re-join the shared store (our accounts may have been unloaded meanwhile)
+            stored_data = {user_id: ItemVector(items) for user_id, items in load_data().items()}
+            account_store.attach(storage_scope, load_users(), stored_data)
+            accounts_attached[0] = True
+        reset_session()
+        # Reconnected -> likely back online, flush anything queued offline
+        drain_delay[0] = QUEUE_DRAIN_MIN_DELAY
+        drain_sync_queue()
+
+    page.on_connect = on_page_connect
     
     def on_page_disconnect(e):
-        """Stop session thread when page disconnects"""
+        """Stop session tracking when page disconnects"""
         session_active[0] = False
+        session_scheduler().cancel(session_key)
+        # Release this page's hold on the shared accounts
+        if accounts_attached[0]:
+            accounts_attached[0] = False
+            account_store.detach(storage_scope)
+        if drain_timer[0]:
+            drain_timer[0].cancel()
+            drain_timer[0] = None  # or schedule_queue_drain() would never re-arm after a reconnect
+        # Let queued pushes finish briefly, then cancel whatever is still running
+        sync_manager.close()
+        cancel_timer[0] = threading.Timer(SYNC_DISCONNECT_GRACE, sync_manager.cancel)
+        cancel_timer[0].daemon = True
+        cancel_timer[0].start()
     
     page.on_disconnect = on_page_disconnect
     
     page.add(auth_view, main_container)
     show_login_screen()
+    timings.record("startup", startup_start, time.perf_counter())
+
+    # Resume pushes left in the offline queue by the previous run
+    drain_sync_queue()
 
 if __name__ == "__main__":
+    # Web downloads left over from a previous run are still publicly served
+    purge_web_exports(max_age=0)
     ft.app(target=main, assets_dir="assets")
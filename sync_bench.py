@@ -0,0 +1,42 @@
+import time
+import argparse
+import statistics
+from main import SyncManager
+from sync_stub_server import start_server
+
+# Compares SyncManager request latency with keep-alive connection reuse
+# against opening a fresh connection per request (the old urllib behaviour).
+
+def measure(manager, requests, fresh):
+    samples = []
+    for i in range(requests):
+        if fresh:
+            manager.close()  # drop idle connections -> next request reconnects
+        start = time.perf_counter()
+        if i % 2:
+            manager._request("POST", "user_data", {"user_id": "bench", "data": {"profile": {}, "items": []}})
+        else:
+            manager._request("GET", "user_data?user_id=eq.bench&select=data")
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+def report(label, samples):
+    ordered = sorted(samples)
+    p99 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.99))]
+    print(f"{label:<12} mean {statistics.mean(samples):7.3f} ms   p50 {statistics.median(samples):7.3f} ms   p99 {p99:7.3f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="SyncManager connection reuse benchmark")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--url", help="Existing stand-in server URL (default: start one locally)")
+    args = parser.parse_args()
+
+    url = args.url
+    if not url:
+        server, url = start_server()
+
+    manager = SyncManager(url=url, key="bench")
+    print(f"Benchmarking {args.requests} requests against {url}")
+    report("fresh conn", measure(manager, args.requests, fresh=True))
+    report("keep-alive", measure(manager, args.requests, fresh=False))
+    manager.close()
@@ -0,0 +1,94 @@
+import time
+import random
+import argparse
+import threading
+import statistics
+from main import SyncManager, SyncError
+from sync_stub_server import start_server, NetworkProfile
+
+# Simulates many devices pushing and pulling against a sync endpoint (by default a
+# local stand-in with configurable latency/errors/bandwidth) and reports throughput,
+# latency percentiles and error counts per operation.
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+def make_package(device, items):
+    return {
+        "profile": {"name": f"Device {device}", "version": 1},
+        "items": [{"id": f"{device:08x}{i:08x}", "version": 1, "name": f"Item {i}", "rate": i} for i in range(items)],
+    }
+
+def run_device(manager, device, args, results, lock):
+    user_id = f"load-{device % args.users}"
+    package = make_package(device, args.items)
+    cursor = None
+    rng = random.Random(device)  # reproducible operation mix per device
+    for op_index in range(args.ops):
+        # Every device starts with a push so its pulls have something to fetch
+        op = "push" if op_index == 0 or rng.random() * 100 >= args.pull_percent else "pull"
+        start = time.perf_counter()
+        ok = True
+        try:
+            if op == "push":
+                manager._send_full(user_id, package)
+            else:
+                pulled = manager.pull_changes(user_id, cursor)
+                if pulled is None:
+                    ok = False
+                else:
+                    cursor = pulled[2]
+        except (SyncError, OSError):
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            results[op]["latency"].append(elapsed)
+            if not ok:
+                results[op]["errors"] += 1
+
+def report(results, wall):
+    total = sum(len(r["latency"]) for r in results.values())
+    errors = sum(r["errors"] for r in results.values())
+    print(f"{total} operations in {wall:.2f} s -> {total / wall:.1f} ops/s, {errors} errors")
+    for op, r in results.items():
+        if not r["latency"]:
+            continue
+        ordered = sorted(r["latency"])
+        print(f"{op:<5} n {len(ordered):6d}   errors {r['errors']:5d}   mean {statistics.mean(ordered):8.2f} ms"
+              f"   p50 {percentile(ordered, 0.5):8.2f} ms   p99 {percentile(ordered, 0.99):8.2f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sync load test: many devices pushing and pulling")
+    parser.add_argument("--devices", type=int, default=20, help="Concurrent simulated devices")
+    parser.add_argument("--users", type=int, default=10, help="Distinct accounts shared by the devices")
+    parser.add_argument("--ops", type=int, default=50, help="Operations per device")
+    parser.add_argument("--pull-percent", type=int, default=70, help="Share of operations that are pulls")
+    parser.add_argument("--items", type=int, default=50, help="Items per pushed portfolio")
+    parser.add_argument("--url", help="Existing endpoint (default: start a local stand-in)")
+    parser.add_argument("--latency", type=float, default=20.0, help="Stand-in latency per request (ms)")
+    parser.add_argument("--jitter", type=float, default=10.0, help="Stand-in random extra latency (ms)")
+    parser.add_argument("--error-rate", type=float, default=0.01, help="Stand-in failure rate")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="Stand-in bandwidth cap in KB/s (0 = unlimited)")
+    args = parser.parse_args()
+
+    url = args.url
+    if not url:
+        network = NetworkProfile(args.latency / 1000, args.jitter / 1000, args.error_rate,
+                                 args.bandwidth * 1024 or None)
+        server, url = start_server(network=network)
+
+    print(f"{args.devices} devices x {args.ops} ops ({args.pull_percent}% pulls) against {url}")
+    results = {"push": {"latency": [], "errors": 0}, "pull": {"latency": [], "errors": 0}}
+    lock = threading.Lock()
+    # One SyncManager per device: each has its own connection pool, like separate phones
+    managers = [SyncManager(url=url, key="load") for _ in range(args.devices)]
+    threads = [threading.Thread(target=run_device, args=(m, i, args, results, lock)) for i, m in enumerate(managers)]
+
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    report(results, time.perf_counter() - start)
+    for m in managers:
+        m.close()
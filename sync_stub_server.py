@@ -0,0 +1,188 @@
+import json
+import time
+import random
+import threading
+import urllib.parse
+import argparse
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Local stand-in for the Supabase REST endpoint used by SyncManager.
+# Implements only the rest/v1 GET/POST/DELETE subset the app needs, kept in memory.
+
+# Upsert key columns per table (PostgREST "on_conflict" / primary key)
+TABLE_KEYS = {
+    "user_data": ("user_id",),
+    "user_records": ("user_id", "record_key"),
+    "user_chunks": ("user_id", "chunk_hash"),
+}
+
+class StubStore:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tables = {name: {} for name in TABLE_KEYS}
+
+    def select(self, table, filters, columns):
+        with self.lock:
+            rows = list(self.tables[table].values())
+        for column, condition in filters.items():
+            rows = [row for row in rows if match_filter(row.get(column), condition)]
+        if columns and columns != "*":
+            names = columns.split(",")
+            rows = [{name: row.get(name) for name in names} for row in rows]
+        return rows
+
+    def upsert(self, table, rows):
+        key_columns = TABLE_KEYS[table]
+        with self.lock:
+            for row in rows:
+                key = tuple(row.get(column) for column in key_columns)
+                # Server-side updated_at, like a "default now()" column plus update trigger
+                self.tables[table][key] = dict(row, updated_at=datetime.now(timezone.utc).isoformat())
+
+    def delete(self, table, filters):
+        with self.lock:
+            rows = self.tables[table]
+            doomed = [key for key, row in rows.items()
+                      if all(match_filter(row.get(column), condition) for column, condition in filters.items())]
+            for key in doomed:
+                del rows[key]
+        return len(doomed)
+
+def match_filter(value, condition):
+    """Evaluate the PostgREST operators SyncManager sends (eq, gt, lt, in, ilike, not.<op>)"""
+    op, _, operand = condition.partition(".")
+    if op == "not":
+        return not match_filter(value, operand)
+    if op == "eq":
+        return str(value) == operand
+    if op in ("gt", "lt"):
+        # ISO-8601 UTC timestamps of one format compare correctly as strings
+        if value is None:
+            return False
+        return str(value) > operand if op == "gt" else str(value) < operand
+    if op == "in":
+        options = [o.strip().strip('"') for o in operand.strip("()").split(",")]
+        return str(value) in options
+    if op == "ilike":
+        return operand.replace("*", "").lower() in str(value).lower()
+    return False
+
+class NetworkProfile:
+    """Simulated network conditions: fixed latency plus jitter, random failures, bandwidth cap"""
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, bandwidth=None):
+        self.latency = latency        # seconds added to every request
+        self.jitter = jitter          # extra 0..jitter seconds, uniformly random
+        self.error_rate = error_rate  # fraction of requests answered with 503
+        self.bandwidth = bandwidth    # bytes/second for request + response bodies, None = unlimited
+
+    def delay(self, size=0):
+        wait = self.latency + random.uniform(0, self.jitter)
+        if self.bandwidth:
+            wait += size / self.bandwidth
+        if wait > 0:
+            time.sleep(wait)
+
+    def should_fail(self):
+        return self.error_rate > 0 and random.random() < self.error_rate
+
+def make_handler(store, network=None):
+    network = network or NetworkProfile()
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"  # keep-alive, like the real endpoint
+        disable_nagle_algorithm = True  # headers and body are written separately
+
+        def log_message(self, format, *args):
+            pass
+
+        def _injected_failure(self, request_size=0):
+            """Apply simulated latency/bandwidth; True if this request should fail"""
+            network.delay(request_size)
+            if network.should_fail():
+                self._send(503, b'{"message": "simulated failure"}')
+                return True
+            return False
+
+        def _table(self):
+            parts = urllib.parse.urlsplit(self.path)
+            prefix = "/rest/v1/"
+            if not parts.path.startswith(prefix):
+                return None, {}
+            table = parts.path[len(prefix):]
+            query = dict(urllib.parse.parse_qsl(parts.query))
+            return (table if table in TABLE_KEYS else None), query
+
+        def _send(self, status, body=b""):
+            if network.bandwidth and body:
+                time.sleep(len(body) / network.bandwidth)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self._injected_failure():
+                return
+            table, query = self._table()
+            if not table:
+                return self._send(404, b'{"message": "relation does not exist"}')
+            columns = query.pop("select", "*")
+            rows = store.select(table, query, columns)
+            self._send(200, json.dumps(rows).encode('utf-8'))
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = self.rfile.read(length)
+            if self._injected_failure(length):
+                return
+            table, _ = self._table()
+            if not table:
+                return self._send(404, b'{"message": "relation does not exist"}')
+            try:
+                rows = json.loads(body.decode('utf-8'))
+            except ValueError:
+                return self._send(400, b'{"message": "invalid json"}')
+            store.upsert(table, rows if isinstance(rows, list) else [rows])
+            self._send(201)
+
+        def do_DELETE(self):
+            if self._injected_failure():
+                return
+            table, query = self._table()
+            if not table:
+                return self._send(404, b'{"message": "relation does not exist"}')
+            store.delete(table, query)
+            self._send(204)
+
+    return StubHandler
+
+def start_server(host="127.0.0.1", port=0, network=None):
+    """Start the stand-in in a background thread; returns (server, base_url)"""
+    store = StubStore()
+    server = ThreadingHTTPServer((host, port), make_handler(store, network))
+    server.daemon_threads = True
+    server.store = store
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Supabase stand-in for sync testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=54321)
+    parser.add_argument("--latency", type=float, default=0.0, help="Added latency per request (ms)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency, 0..N ms")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests failing with 503")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="Body transfer cap in KB/s (0 = unlimited)")
+    args = parser.parse_args()
+
+    network = NetworkProfile(args.latency / 1000, args.jitter / 1000, args.error_rate,
+                             args.bandwidth * 1024 or None)
+    server, url = start_server(args.host, args.port, network)
+    print(f"Stub server running at {url} (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        print("\nStopped.")
@@ -1,16 +1,17 @@
 import urllib.request
 import json
 import urllib.parse
+import argparse
 
 class SyncManager:
-    def __init__(self):
+    def __init__(self, url=None, key=None):
         self.enabled = False
         self.url = ""
         self.headers = {}
         try:
             # CREDENTIALS
-            URL = "https://jlidoznndxqhvtvgwqnj.supabase.co"
-            KEY = "sb_publishable_8RX9HzSr7aKQfh6WTjlSqg_n6tlaYDF"
+            URL = url or "https://jlidoznndxqhvtvgwqnj.supabase.co"
+            KEY = key or "sb_publishable_8RX9HzSr7aKQfh6WTjlSqg_n6tlaYDF"
             
             if "YOUR_" not in URL:
                 self.url = URL
@@ -46,8 +47,13 @@ class SyncManager:
         return None
 
 if __name__ == "__main__":
-    manager = SyncManager()
-    user_to_check = "yashborse005"
+    parser = argparse.ArgumentParser(description="Check whether a user exists in the cloud user_data table")
+    parser.add_argument("user", nargs="?", default="yashborse005")
+    parser.add_argument("--url", help="Alternative endpoint, e.g. a local sync_stub_server.py")
+    args = parser.parse_args()
+
+    manager = SyncManager(url=args.url, key="local" if args.url else None)
+    user_to_check = args.user
     print(f"Checking for user: {user_to_check}...")
     result = manager.pull_data(user_to_check)
     